@@ -1,11 +1,50 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
+from db_config import settings
+from exception import ServiceBusyError
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt is deliberately slow (~200ms per call), so it never runs on the event loop.
+# Hashing happens on a small dedicated thread pool (bcrypt releases the GIL while hashing),
+# and once PASSWORD_HASH_MAX_PENDING calls are queued or running new ones are rejected right away
+# instead of piling up behind a login storm.
+password_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+pending_password_jobs = 0 # only touched from the event loop thread, so no lock needed
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str: # Only store hashed passwords in db
-    return pwd_context.hash(password)
\ No newline at end of file
+    return pwd_context.hash(password)
+
+
+async def run_password_job(func, *args):
+    global pending_password_jobs
+
+    if pending_password_jobs >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise ServiceBusyError("Too many authentication requests, please try again shortly.")
+
+    # The slot is released when the thread pool job is done, not when this coroutine ends: a request cancelled by a
+    # client disconnect stops awaiting, but a job that already started keeps hashing on its thread until it finishes.
+    loop = asyncio.get_running_loop()
+    pending_password_jobs += 1
+    job = password_executor.submit(func, *args)
+    job.add_done_callback(lambda _: loop.call_soon_threadsafe(release_password_job))
+    return await asyncio.wrap_future(job)
+
+
+def release_password_job():
+    global pending_password_jobs
+    pending_password_jobs -= 1
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_job(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await run_password_job(get_password_hash, password)
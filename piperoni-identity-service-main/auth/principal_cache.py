@@ -0,0 +1,11 @@
+from utils.ttl_cache import TTLCache
+from db_config import settings
+
+# Resolved users keyed by the JWT subject (user email), so repeat requests with the same token skip
+# the users table lookup. Entries never outlive the token they were resolved from, and are dropped
+# whenever the user row is deleted or its credentials change (see AsyncDBHandler).
+principal_cache = TTLCache(maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL)
+
+# Ids of users known to exist, so socket DMs can check the receiver without a query per message.
+# Dropped when the user is deleted; a stale hit is still caught by the chats foreign key.
+known_user_ids = TTLCache(maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL)
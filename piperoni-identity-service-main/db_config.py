@@ -16,6 +16,57 @@ class Settings:
     POSTGRES_PORT : str = os.getenv("POSTGRES_PORT", 5432) # default postgres port is 5432
     POSTGRES_DB : str = os.getenv("POSTGRES_DB", "identity_database")
     DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    ASYNC_DATABASE_URL = f"postgresql+psycopg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}" # psycopg 3 async driver
+
+    # Connection pool settings, applied per engine per worker process.
+    # Keep (DB_POOL_SIZE + DB_MAX_OVERFLOW) * number of workers below postgres max_connections.
+    DB_POOL_SIZE : int = int(os.getenv("DB_POOL_SIZE", 10)) # connections kept open in the pool
+    DB_MAX_OVERFLOW : int = int(os.getenv("DB_MAX_OVERFLOW", 20)) # extra connections allowed during bursts
+    DB_POOL_RECYCLE : int = int(os.getenv("DB_POOL_RECYCLE", 1800)) # seconds before a connection is replaced, -1 disables
+    DB_POOL_PRE_PING : bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true" # test connections before handing them out
+    DB_POOL_TIMEOUT : int = int(os.getenv("DB_POOL_TIMEOUT", 10)) # seconds to wait for a free connection before failing
+    DB_STATEMENT_TIMEOUT_MS : int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 15000)) # postgres statement_timeout, 0 disables
+
+    # Password hashing pool, see auth/auth_password.py
+    PASSWORD_HASH_WORKERS : int = int(os.getenv("PASSWORD_HASH_WORKERS", 2)) # threads doing bcrypt work
+    PASSWORD_HASH_MAX_PENDING : int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 16)) # running + queued hashes before returning 503
+
+    # Authenticated user cache used by get_current_user
+    PRINCIPAL_CACHE_SIZE : int = int(os.getenv("PRINCIPAL_CACHE_SIZE", 10000)) # max cached users per worker
+    PRINCIPAL_CACHE_TTL : int = int(os.getenv("PRINCIPAL_CACHE_TTL", 300)) # seconds, also capped by the token's exp
+
+    # Genre / instrument catalog cache, see services/catalog_cache.py
+    CATALOG_CACHE_TTL : int = int(os.getenv("CATALOG_CACHE_TTL", 300)) # seconds
+
+    # Bandmate recommendations, see services/recommender.py
+    RECOMMENDER_REFRESH_SECONDS : int = int(os.getenv("RECOMMENDER_REFRESH_SECONDS", 300)) # full rebuild interval, picks up other workers' writes
+
+    # Faceted filter, see services/facet_index.py
+    FACET_INDEX_REFRESH_SECONDS : int = int(os.getenv("FACET_INDEX_REFRESH_SECONDS", 300)) # full rebuild interval, picks up other workers' writes
+
+    # Upload limits, enforced on the request body while it arrives (see UploadSizeLimitMiddleware) and on the file itself
+    MAX_AUDIO_UPLOAD_BYTES : int = int(os.getenv("MAX_AUDIO_UPLOAD_BYTES", 20 * 1024 * 1024))
+    MAX_IMAGE_UPLOAD_BYTES : int = int(os.getenv("MAX_IMAGE_UPLOAD_BYTES", 10 * 1024 * 1024))
+    UPLOAD_FORM_OVERHEAD_BYTES : int = int(os.getenv("UPLOAD_FORM_OVERHEAD_BYTES", 64 * 1024)) # multipart boundaries and part headers on top of the file
+
+    # Media storage, see storage/media_store.py
+    MEDIA_STORE_BACKEND : str = os.getenv("MEDIA_STORE_BACKEND", "local") # "local" or "s3"
+    MEDIA_ROOT : str = os.getenv("MEDIA_ROOT", "media") # local backend only, relative to the working directory; docker-compose uses /media
+    LEGACY_MEDIA_ROOT : str = os.getenv("LEGACY_MEDIA_ROOT", "/") # holds the audio/ and pics/ folders uploads were written to before the media store
+    MEDIA_S3_BUCKET : str = os.getenv("MEDIA_S3_BUCKET", "piperoni-media")
+    MEDIA_S3_ENDPOINT_URL = os.getenv("MEDIA_S3_ENDPOINT_URL") # set for MinIO / other S3 compatible servers
+    MEDIA_S3_REGION = os.getenv("MEDIA_S3_REGION")
+    MEDIA_S3_ACCESS_KEY = os.getenv("MEDIA_S3_ACCESS_KEY")
+    MEDIA_S3_SECRET_KEY = os.getenv("MEDIA_S3_SECRET_KEY")
+
+    # Realtime chat across workers, see sockets/presence.py. Leave REDIS_URL unset to run a single process without redis.
+    REDIS_URL = os.getenv("REDIS_URL") # e.g. redis://localhost:6379/0
+    SOCKETIO_CHANNEL : str = os.getenv("SOCKETIO_CHANNEL", "socketio")
+    PRESENCE_TTL_SECONDS : int = int(os.getenv("PRESENCE_TTL_SECONDS", 60)) # a crashed worker's sockets count as online for at most this long
+    DM_BACKLOG_BATCH_SIZE : int = int(os.getenv("DM_BACKLOG_BATCH_SIZE", 200)) # undelivered messages pushed per emit on connect
+
+    # Batch avatar endpoint, see routers/files.py
+    AVATAR_BATCH_CONCURRENCY : int = int(os.getenv("AVATAR_BATCH_CONCURRENCY", 8)) # parallel file reads per batch avatar request
 
 settings = Settings()
 
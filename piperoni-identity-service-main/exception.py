@@ -18,3 +18,7 @@ class AuthError(AppError):
 
 class InvalidParameterError(NotFoundError):
     pass
+
+
+class ServiceBusyError(AppError):
+    pass
@@ -0,0 +1,720 @@
+import math
+from auth.auth_password import get_password_hash_async
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert, REGCONFIG
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import select, delete, update, func, tuple_, union, and_, or_, case, literal, ARRAY, Integer
+from sqlalchemy.orm import with_expression
+from models import User as user_table, Genre as genre_table, PersonalGenre as personal_genre_table, Instrument as instrument_table, PersonalInstrument as personal_instrument_table, UserDetail as user_detail_table, Chat as chat_table, Follow as follow_table, DeliveryCursor as delivery_cursor_table, Conversation as conversation_table
+from schemas import User, Genre, Instrument
+from exception import AlreadyExistsError, InvalidParameterError, NotFoundError
+from utils.email_verification import is_valid_email
+from auth.auth_password import verify_password_async
+from auth.principal_cache import principal_cache, known_user_ids
+from services.catalog_cache import catalog_cache
+from services.recommender import bandmate_recommender
+from services.facet_index import facet_index
+from utils import geohash
+from typing import List
+
+# In-memory indexes over personal genres / instruments and preferences, updated after every committed write
+tag_indexes = (bandmate_recommender, facet_index)
+
+# kind -> (table, tag id column, unique (user_id, tag id) constraint)
+personal_tag_tables = {
+    "genres": (personal_genre_table, personal_genre_table.genre_id, "unique_personal_genre"),
+    "instruments": (personal_instrument_table, personal_instrument_table.instrument_id, "unique_personal_instrument"),
+}
+
+# Distances shown to other users are rounded up to whole steps, so positions can't be trilaterated from them
+NEARBY_DISTANCE_STEP_KM = 1
+
+# Database access for the routers and the socket server. Every query is awaited on an AsyncSession so a slow round trip
+# only suspends the current request instead of blocking the whole event loop.
+# Relationships are never lazy loaded here (that is not allowed on an async session), so queries
+# that need related rows either join them or eager load them up front.
+class AsyncDBHandler:
+
+    def __init__(self, db: AsyncSession) -> None:
+        super().__init__()
+        self._db = db
+
+    async def get_user_by_email(self, email: str):
+        result = await self._db.execute(select(user_table).filter(user_table.email == email.strip()))
+        return result.scalars().first()
+
+    async def get_user_by_id(self, user_id: int):
+        result = await self._db.execute(select(user_table).filter(user_table.id == user_id))
+        return result.scalars().first()
+
+    async def get_users(self, skip: int = 0, limit: int = 100):
+        result = await self._db.execute(select(user_table).offset(skip).limit(limit))
+        return result.scalars().all()
+
+    # Tags for one page of users in a single round trip: page the users first, then join and aggregate
+    # only those rows, so the cost follows the page size instead of users x tags. limit=None returns every user.
+    async def get_all_users_genres(self, skip: int = 0, limit: int = None):
+        page = select(user_table.id).order_by(user_table.id).offset(skip).limit(limit).subquery()
+        genre_names = func.array_remove(func.array_agg(aggregate_order_by(genre_table.name, personal_genre_table.id)), None)
+        query = (select(page.c.id, genre_names)
+                 .outerjoin(personal_genre_table, personal_genre_table.user_id == page.c.id)
+                 .outerjoin(genre_table, genre_table.id == personal_genre_table.genre_id)
+                 .group_by(page.c.id)
+                 .order_by(page.c.id))
+        result = await self._db.execute(query)
+        return [{"user_id": user_id, "genres": genres} for user_id, genres in result.all()]
+
+    async def get_all_users_instruments(self, skip: int = 0, limit: int = None):
+        page = select(user_table.id).order_by(user_table.id).offset(skip).limit(limit).subquery()
+        instrument_names = func.array_remove(func.array_agg(aggregate_order_by(instrument_table.name, personal_instrument_table.id)), None)
+        query = (select(page.c.id, instrument_names)
+                 .outerjoin(personal_instrument_table, personal_instrument_table.user_id == page.c.id)
+                 .outerjoin(instrument_table, instrument_table.id == personal_instrument_table.instrument_id)
+                 .group_by(page.c.id)
+                 .order_by(page.c.id))
+        result = await self._db.execute(query)
+        return [{"user_id": user_id, "instruments": instruments} for user_id, instruments in result.all()]
+
+    async def authenticate_user(self, email: str, password: str): # custom auth
+        db_user = await self.get_user_by_email(email)
+        if not db_user or db_user.oauth2:
+            return False
+        if not await verify_password_async(password, db_user.hashed_password):
+            return False
+        return db_user
+
+    async def create_user(self, user: User, oauth: bool):
+        user_email = user.email.strip()
+        password = user.password.strip()
+
+        db_user = await self.get_user_by_email(user_email)
+        # Sanity check
+        if db_user:
+            raise AlreadyExistsError("Email already exists.")
+        if not user_email or len(user_email) == 0:
+            raise InvalidParameterError("Email is required.")
+        if not is_valid_email(user_email):
+            raise InvalidParameterError("Please provide a valid email.")
+        if not password or len(password) == 0:
+            raise InvalidParameterError("Password is required")
+
+        user_hash = await get_password_hash_async(password) # Unique to each user
+        db_user = user_table(email=user.email, hashed_password=user_hash, oauth2=oauth)
+
+        self._db.add(db_user)
+        await self._db.commit()
+        await self._db.refresh(db_user)
+        principal_cache.invalidate(user_email)
+
+        return db_user
+
+    async def delete_user_by_email(self, email: str):
+        db_user = await self.get_user_by_email(email)
+        if not db_user:
+            raise NotFoundError("User email not found.")
+        query = delete(user_table).where(user_table.email == email.strip())
+        response = await self._db.execute(query)
+
+        await self._db.commit()
+        principal_cache.invalidate(email.strip()) # tokens issued to the deleted user must stop working right away
+        known_user_ids.invalidate(db_user.id)
+        for index in tag_indexes:
+            index.remove_user(db_user.id)
+
+        return response
+
+    # Genres table queries
+    async def load_genre_catalog(self):
+        result = await self._db.execute(select(genre_table.id, genre_table.name).order_by(genre_table.id))
+        return [{"id": genre_id, "name": name} for genre_id, name in result.all()]
+
+    async def get_all_music_genres(self, skip: int = 0, limit: int = 100):
+        genres = await catalog_cache.get("genres", self.load_genre_catalog)
+        return genres[skip:skip + limit]
+
+    async def create_genre(self, genre: Genre):
+        name = genre.name
+        db_genre = await self.get_genre_by_name(name)
+        if db_genre:
+            raise AlreadyExistsError("Genre already exists.")
+
+        db_genre = genre_table(name=name)
+
+        self._db.add(db_genre)
+        await self._db.commit()
+        await self._db.refresh(db_genre)
+        catalog_cache.invalidate("genres")
+
+        return db_genre
+
+    async def get_genre_by_name(self, name:str):
+        if not name or len(name) == 0:
+            raise InvalidParameterError("Genre name is required.")
+
+        name = name.strip()
+        result = await self._db.execute(select(genre_table).filter(genre_table.name == name))
+        return result.scalars().first()
+
+
+    async def delete_genre_by_name(self, name: str):
+        db_genre = await self.get_genre_by_name(name)
+        if not db_genre:
+            raise NotFoundError("Genre not found.")
+
+        query = delete(genre_table).where(genre_table.name == name.strip())
+        response = await self._db.execute(query)
+
+        await self._db.commit()
+        catalog_cache.invalidate("genres")
+        for index in tag_indexes:
+            index.invalidate() # personal genres cascade away with the genre
+
+        return response
+
+
+    async def delete_current_user_genre(self, user_id: int, genre_id: int):
+        query = delete(personal_genre_table).where(personal_genre_table.genre_id == genre_id, personal_genre_table.user_id==user_id)
+        result = await self._db.execute(query)
+        if result.rowcount == 0:
+            await self._db.rollback()
+            raise NotFoundError("Current user does not have the specified genre.")
+
+        await self._db.commit()
+        for index in tag_indexes:
+            index.remove_tags("genres", user_id, [genre_id])
+
+        return
+
+    async def create_current_user_genres(self, genre_id: List[int], user_id: int):
+        return await self.add_personal_tags("genres", user_id, genre_id)
+
+    async def replace_current_user_genres(self, genre_id: List[int], user_id: int):
+        return await self.replace_personal_tags("genres", user_id, genre_id)
+
+    async def get_current_user_genre_ids(self, user_id: int):
+        result = await self._db.execute(select(personal_genre_table.genre_id).where(personal_genre_table.user_id == user_id))
+        return set(result.scalars().all())
+
+    async def get_current_user_genres(self, user_id: int):
+        query = select(genre_table).join(personal_genre_table, personal_genre_table.genre_id == genre_table.id).where(personal_genre_table.user_id == user_id)
+        result = await self._db.execute(query)
+        return result.scalars().all()
+
+    async def get_all_personal_genres(self, skip: int = 0, limit: int = 100):
+        result = await self._db.execute(select(personal_genre_table).offset(skip).limit(limit))
+        return result.scalars().all()
+
+    # Instrument table queries
+    async def load_instrument_catalog(self):
+        result = await self._db.execute(select(instrument_table.id, instrument_table.name).order_by(instrument_table.id))
+        return [{"id": instrument_id, "name": name} for instrument_id, name in result.all()]
+
+    async def get_all_instruments(self, skip: int = 0, limit: int = 100):
+        instruments = await catalog_cache.get("instruments", self.load_instrument_catalog)
+        return instruments[skip:skip + limit]
+
+    async def get_instrument_by_name(self, name: str):
+        if not name or len(name) == 0:
+            raise InvalidParameterError("Instrument name is required.")
+
+        name = name.strip()
+        result = await self._db.execute(select(instrument_table).filter(instrument_table.name == name))
+        return result.scalars().first()
+
+
+    async def create_instrument(self, instrument: Instrument):
+        instrument_name = instrument.name
+        db_instrument = await self.get_instrument_by_name(instrument_name)
+        if db_instrument:
+            raise AlreadyExistsError("Instrument already exists")
+
+        db_instrument = instrument_table(name=instrument_name)
+        self._db.add(db_instrument)
+        await self._db.commit()
+        await self._db.refresh(db_instrument)
+        catalog_cache.invalidate("instruments")
+
+        return db_instrument
+
+    async def delete_instrument_by_name(self, instrument_name: str):
+        db_instrument = await self.get_instrument_by_name(instrument_name)
+        if not db_instrument:
+            raise NotFoundError("Instrument not found.")
+
+        query = delete(instrument_table).where(instrument_table.name == instrument_name)
+        await self._db.execute(query)
+        await self._db.commit()
+        catalog_cache.invalidate("instruments")
+        for index in tag_indexes:
+            index.invalidate() # personal instruments cascade away with the instrument
+
+        return
+
+    async def delete_current_user_instrument_by_id(self, user_id: int, instrument_id: int):
+        query = delete(personal_instrument_table).where(personal_instrument_table.instrument_id == instrument_id, personal_instrument_table.user_id== user_id)
+        result = await self._db.execute(query)
+        if result.rowcount == 0:
+            await self._db.rollback()
+            raise NotFoundError("Current user doesn't have specified instrument.")
+
+        await self._db.commit()
+        for index in tag_indexes:
+            index.remove_tags("instruments", user_id, [instrument_id])
+
+        return
+
+    async def create_personal_instruments(self, user_id: int, instrument_id: List[int]):
+        return await self.add_personal_tags("instruments", user_id, instrument_id)
+
+    async def replace_personal_instruments(self, user_id: int, instrument_id: List[int]):
+        return await self.replace_personal_tags("instruments", user_id, instrument_id)
+
+    async def get_current_user_instrument_ids(self, user_id: int):
+        result = await self._db.execute(select(personal_instrument_table.instrument_id).where(personal_instrument_table.user_id == user_id))
+        return set(result.scalars().all())
+
+    async def get_current_user_instruments(self, user_id):
+        query = select(instrument_table).join(personal_instrument_table, personal_instrument_table.instrument_id == instrument_table.id).where(personal_instrument_table.user_id == user_id)
+        result = await self._db.execute(query)
+        return result.scalars().all()
+
+    # Personal genres / instruments are written as sets. INSERT ... ON CONFLICT DO NOTHING makes adding a tag
+    # the user already has a no-op instead of a unique violation, and replacing the whole set is that insert
+    # plus one DELETE ... WHERE tag NOT IN (...), both in one transaction.
+    def insert_personal_tags_query(self, kind: str, user_id: int, tag_ids: List[int]):
+        table, tag_column, constraint = personal_tag_tables[kind]
+        return insert(table).values([{"user_id": user_id, tag_column.key: tag_id} for tag_id in tag_ids]).on_conflict_do_nothing(constraint=constraint)
+
+    # Returns the newly added rows, tags the user already had are left untouched
+    async def add_personal_tags(self, kind: str, user_id: int, tag_ids: List[int]):
+        table, tag_column, _ = personal_tag_tables[kind]
+        tag_ids = list(dict.fromkeys(tag_ids))
+        if not tag_ids:
+            return []
+
+        try:
+            added = (await self._db.scalars(self.insert_personal_tags_query(kind, user_id, tag_ids).returning(table))).all()
+            await self._db.commit()
+        except IntegrityError:
+            await self._db.rollback()
+            raise NotFoundError(f"One or more {kind} do not exist.")
+
+        for index in tag_indexes:
+            index.add_tags(kind, user_id, [getattr(row, tag_column.key) for row in added])
+
+        return added
+
+    # Makes tag_ids the user's complete set of tags, returns the resulting ids and what was added and removed
+    async def replace_personal_tags(self, kind: str, user_id: int, tag_ids: List[int]):
+        table, tag_column, _ = personal_tag_tables[kind]
+        tag_ids = list(dict.fromkeys(tag_ids))
+
+        try:
+            added = []
+            if tag_ids:
+                added = (await self._db.scalars(self.insert_personal_tags_query(kind, user_id, tag_ids).returning(tag_column))).all()
+            removed = (await self._db.scalars(delete(table).where(table.user_id == user_id, tag_column.notin_(tag_ids)).returning(tag_column))).all()
+            await self._db.commit()
+        except IntegrityError:
+            await self._db.rollback()
+            raise NotFoundError(f"One or more {kind} do not exist.")
+
+        for index in tag_indexes:
+            index.add_tags(kind, user_id, added)
+            index.remove_tags(kind, user_id, removed)
+
+        return {"ids": sorted(tag_ids), "added": sorted(added), "removed": sorted(removed)}
+
+    # Personal detail table queries
+    # Details payloads carry the ids of the user's followers and of who they follow (clients read the follow graph
+    # from them), loaded from the follows table as correlated subqueries of the same statement
+    def select_details_with_follows(self):
+        followers = (select(func.array_agg(aggregate_order_by(follow_table.follower_id, follow_table.follower_id)))
+                     .where(follow_table.followee_id == user_detail_table.user_id)
+                     .scalar_subquery())
+        following = (select(func.array_agg(aggregate_order_by(follow_table.followee_id, follow_table.followee_id)))
+                     .where(follow_table.follower_id == user_detail_table.user_id)
+                     .scalar_subquery())
+        no_ids = literal([], ARRAY(Integer))
+        return (select(user_detail_table)
+                .options(with_expression(user_detail_table.followers, func.coalesce(followers, no_ids)),
+                         with_expression(user_detail_table.following, func.coalesce(following, no_ids)))
+                .execution_options(populate_existing=True)) # refresh rows already in the session, e.g. after an update
+
+    async def get_current_user_personal_details(self, user_id: int, with_follows: bool = False):
+        query = self.select_details_with_follows() if with_follows else select(user_detail_table)
+        result = await self._db.execute(query.filter(user_detail_table.user_id == user_id))
+        return result.scalars().first()
+
+    async def get_profile_pictures(self, user_ids: List[int]):
+        query = select(user_detail_table.user_id, user_detail_table.profile_picture).where(user_detail_table.user_id.in_(user_ids))
+        result = await self._db.execute(query)
+        return {user_id: profile_picture for user_id, profile_picture in result.all()}
+
+    async def get_all_user_personal_details(self):
+        result = await self._db.execute(self.select_details_with_follows())
+        return result.scalars().all()
+
+
+    async def create_current_user_personal_details(self, first_name: str, last_name: str, title: str, description: str, preference, address: str, user_id: int):
+        db_user = await self.get_current_user_personal_details(user_id)
+        if db_user:
+            raise AlreadyExistsError("User details have already been created.")
+
+        db_instance = user_detail_table(first_name=first_name, last_name=last_name, user_id=user_id, title=title, description=description, preference=preference, address=address)
+        self._db.add(db_instance)
+        await self._db.commit()
+        await self._db.refresh(db_instance)
+        for index in tag_indexes:
+            index.set_preference(user_id, db_instance.preference)
+
+        return await self.get_current_user_personal_details(user_id, with_follows=True)
+
+    async def update_current_user_personal_details_fields(self, field: str, data: str, user_id: int):
+        query = update(user_detail_table).where(user_detail_table.user_id == user_id).values({field: data}).returning(user_detail_table)
+        updated_user_detail = (await self._db.execute(query)).scalars().first()
+        if not updated_user_detail:
+            await self._db.rollback()
+            raise NotFoundError("User has not initialized personal details.")
+
+        await self._db.commit()
+        if field == "preference":
+            for index in tag_indexes:
+                index.set_preference(user_id, updated_user_detail.preference)
+
+        return await self.get_current_user_personal_details(user_id, with_follows=True) # RETURNING can't load the follow ids
+
+    # Directory search: full text matches (GIN on search_vector) or substring matches on name, title and
+    # address (pg_trgm GIN on search_text), ranked by text relevance with a bonus for substring hits.
+    async def search_user_details(self, q: str, preference=None, skip: int = 0, limit: int = 20):
+        q = q.strip()
+        if not q:
+            raise InvalidParameterError("Search query should not be empty.")
+
+        ts_query = func.websearch_to_tsquery(literal("simple").cast(REGCONFIG), q)
+        pattern = "%" + q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        substring_match = user_detail_table.search_text.like(pattern, escape="\\")
+        rank = func.ts_rank_cd(user_detail_table.search_vector, ts_query) + case((substring_match, 0.5), else_=0.0)
+
+        query = (
+            select(user_detail_table.user_id, user_detail_table.first_name, user_detail_table.last_name, user_detail_table.title,
+                   user_detail_table.description, user_detail_table.preference, user_detail_table.address, rank.label("rank"))
+            .where(or_(user_detail_table.search_vector.op("@@")(ts_query), substring_match))
+            .order_by(rank.desc(), user_detail_table.user_id)
+            .offset(skip)
+            .limit(limit)
+        )
+        if preference:
+            query = query.where(user_detail_table.preference == preference)
+
+        result = await self._db.execute(query)
+        return [{**row._mapping, "rank": round(row.rank, 4)} for row in result.all()]
+
+    async def update_current_user_location(self, user_id: int, latitude: float, longitude: float):
+        query = (
+            update(user_detail_table)
+            .where(user_detail_table.user_id == user_id)
+            .values(latitude=latitude, longitude=longitude, geohash=geohash.encode(latitude, longitude))
+            .returning(user_detail_table)
+        )
+        updated_user_detail = (await self._db.execute(query)).scalars().first()
+        if not updated_user_detail:
+            await self._db.rollback()
+            raise NotFoundError("User has not initialized personal details.")
+
+        await self._db.commit()
+
+        return await self.get_current_user_personal_details(user_id, with_follows=True)
+
+    # Users within radius_km of a point, nearest first. Candidates come from the geohash cell containing the
+    # point and its 8 neighbours (cells at least radius_km wide, so together they cover the circle), each a
+    # prefix range on the geohash index, so the cost depends on how many users are nearby, not on the total.
+    # Only coarse distances (NEARBY_DISTANCE_STEP_KM) are returned, and users at the same coarse distance are
+    # ordered by id, so neither the values nor the order reveal more.
+    async def get_nearby_users(self, latitude: float, longitude: float, radius_km: float, preference=None, exclude_user_id: int = None, limit: int = 50):
+        radius_km = max(radius_km, NEARBY_DISTANCE_STEP_KM)
+        precision = geohash.precision_for_radius(radius_km, latitude)
+        cells = geohash.neighbours(geohash.encode(latitude, longitude, precision))
+
+        query = (
+            select(user_detail_table.user_id, user_detail_table.first_name, user_detail_table.last_name, user_detail_table.title,
+                   user_detail_table.preference, user_detail_table.latitude, user_detail_table.longitude)
+            .where(or_(*[user_detail_table.geohash.startswith(cell, autoescape=True) for cell in cells]))
+        )
+        if preference:
+            query = query.where(user_detail_table.preference == preference)
+        if exclude_user_id is not None:
+            query = query.where(user_detail_table.user_id != exclude_user_id)
+
+        nearby = []
+        for row in (await self._db.execute(query)).all():
+            # the radius is compared with the coarse distance too, so varying radius_km can't narrow it down
+            distance_km = max(1, math.ceil(geohash.haversine_km(latitude, longitude, row.latitude, row.longitude) / NEARBY_DISTANCE_STEP_KM)) * NEARBY_DISTANCE_STEP_KM
+            if distance_km <= radius_km:
+                nearby.append({
+                    "user_id": row.user_id,
+                    "first_name": row.first_name,
+                    "last_name": row.last_name,
+                    "title": row.title,
+                    "preference": row.preference,
+                    "distance_km": distance_km,
+                })
+
+        nearby.sort(key=lambda user: (user["distance_km"], user["user_id"]))
+        return nearby[:limit]
+
+    # Everything the tag indexes (bandmate recommender, facet index) hold, as plain (user id, tag id) / (user id, preference) rows
+    async def load_user_tag_rows(self):
+        genre_rows = (await self._db.execute(select(personal_genre_table.user_id, personal_genre_table.genre_id))).all()
+        instrument_rows = (await self._db.execute(select(personal_instrument_table.user_id, personal_instrument_table.instrument_id))).all()
+        preference_rows = (await self._db.execute(select(user_detail_table.user_id, user_detail_table.preference))).all()
+        return [tuple(row) for row in genre_rows], [tuple(row) for row in instrument_rows], [tuple(row) for row in preference_rows]
+
+    async def get_bandmate_recommendations(self, user_id: int, limit: int = 20):
+        await bandmate_recommender.ensure_loaded(self.load_user_tag_rows)
+        return bandmate_recommender.recommend(user_id, limit)
+
+    async def filter_users_by_facets(self, genre_ids: List[int], instrument_ids: List[int], preference=None, after: int = None, limit: int = 50):
+        await facet_index.ensure_loaded(self.load_user_tag_rows)
+        selected = {"genres": genre_ids, "instruments": instrument_ids, "preferences": [preference] if preference else None}
+        user_ids, total, facet_counts = facet_index.filter(selected, after, limit)
+        return {
+            "user_ids": user_ids,
+            "total": total,
+            "facets": {
+                "genres": facet_counts["genres"],
+                "instruments": facet_counts["instruments"],
+                "preferences": {preference.value: count for preference, count in facet_counts["preferences"].items()},
+            },
+        }
+
+    # Follow graph queries
+    async def follow_user(self, current_user_id: int, other_user_id: int):
+        if current_user_id == other_user_id:
+            raise InvalidParameterError("Users cannot follow themselves.")
+
+        # Following twice is a no-op thanks to the (follower, followee) primary key
+        query = insert(follow_table).values(follower_id=current_user_id, followee_id=other_user_id).on_conflict_do_nothing()
+        try:
+            await self._db.execute(query)
+            await self._db.commit()
+        except IntegrityError:
+            await self._db.rollback()
+            raise NotFoundError("Other user does not exist.")
+
+        return {"follower_id": current_user_id, "followee_id": other_user_id, "following": True}
+
+    async def unfollow_user(self, current_user_id: int, other_user_id: int):
+        query = delete(follow_table).where(follow_table.follower_id == current_user_id, follow_table.followee_id == other_user_id)
+        await self._db.execute(query)
+        await self._db.commit()
+
+        return {"follower_id": current_user_id, "followee_id": other_user_id, "following": False}
+
+    # Follower / following ids are paged in id order, pass the last id of a page as `after` to get the next one
+    async def get_followers(self, user_id: int, after: int = None, limit: int = 50):
+        query = select(follow_table.follower_id).where(follow_table.followee_id == user_id)
+        if after:
+            query = query.where(follow_table.follower_id > after)
+        result = await self._db.execute(query.order_by(follow_table.follower_id).limit(limit))
+        return result.scalars().all()
+
+    async def get_following(self, user_id: int, after: int = None, limit: int = 50):
+        query = select(follow_table.followee_id).where(follow_table.follower_id == user_id)
+        if after:
+            query = query.where(follow_table.followee_id > after)
+        result = await self._db.execute(query.order_by(follow_table.followee_id).limit(limit))
+        return result.scalars().all()
+
+    async def get_follow_counts(self, user_id: int):
+        followers = select(func.count()).select_from(follow_table).where(follow_table.followee_id == user_id).scalar_subquery()
+        following = select(func.count()).select_from(follow_table).where(follow_table.follower_id == user_id).scalar_subquery()
+        result = await self._db.execute(select(followers, following))
+        followers_count, following_count = result.one()
+        return {"followers": followers_count, "following": following_count}
+
+    # Everything a profile screen shows in one round trip: the details row is joined and the tag names, follow
+    # counts and the viewer's follow state are correlated subqueries of the same statement.
+    async def get_user_profile(self, user_id: int, viewer_id: int = None):
+        genre_names = (select(func.array_agg(aggregate_order_by(genre_table.name, personal_genre_table.id)))
+                       .select_from(personal_genre_table)
+                       .join(genre_table, genre_table.id == personal_genre_table.genre_id)
+                       .where(personal_genre_table.user_id == user_table.id)
+                       .scalar_subquery())
+        instrument_names = (select(func.array_agg(aggregate_order_by(instrument_table.name, personal_instrument_table.id)))
+                            .select_from(personal_instrument_table)
+                            .join(instrument_table, instrument_table.id == personal_instrument_table.instrument_id)
+                            .where(personal_instrument_table.user_id == user_table.id)
+                            .scalar_subquery())
+        followers = select(func.count()).select_from(follow_table).where(follow_table.followee_id == user_table.id).scalar_subquery()
+        following = select(func.count()).select_from(follow_table).where(follow_table.follower_id == user_table.id).scalar_subquery()
+        is_following = select(follow_table.follower_id).where(follow_table.follower_id == viewer_id, follow_table.followee_id == user_table.id).exists()
+
+        query = (select(user_table.id, user_detail_table, genre_names, instrument_names, followers, following, is_following)
+                 .outerjoin(user_detail_table, user_detail_table.user_id == user_table.id)
+                 .where(user_table.id == user_id))
+        row = (await self._db.execute(query)).first()
+        if not row:
+            raise NotFoundError("User does not exist.")
+
+        _, details, genres, instruments, followers_count, following_count, viewer_follows = row
+        return {
+            "user_id": user_id,
+            "details": details,
+            "genres": genres or [],
+            "instruments": instruments or [],
+            "follow_counts": {"followers": followers_count, "following": following_count},
+            "following": viewer_follows,
+        }
+
+    # personal chat queries
+
+    async def get_chat_cursor(self, message_id: int):
+        result = await self._db.execute(select(chat_table.timestamp, chat_table.id).where(chat_table.id == message_id))
+        cursor = result.first()
+        if not cursor:
+            raise InvalidParameterError("Invalid chat cursor.")
+        return tuple(cursor)
+
+    # Keyset pagination over chats, newest first. Every condition is answered by its own index range scan
+    # (limited to one page), then the candidates are merged, so a page costs the same however long the history is.
+    # A message can match several conditions (a self-DM is both sent and received), so the merge drops duplicates.
+    async def get_chat_page(self, conditions, before: int = None, after: int = None, limit: int = 50):
+        if before and after:
+            raise InvalidParameterError("Only one of before / after can be provided.")
+
+        key = tuple_(chat_table.timestamp, chat_table.id)
+        newer = after is not None
+        cursor = await self.get_chat_cursor(after if newer else before) if (before or after) else None
+        order = (chat_table.timestamp.asc(), chat_table.id.asc()) if newer else (chat_table.timestamp.desc(), chat_table.id.desc())
+
+        candidates = []
+        for condition in conditions:
+            query = select(chat_table.id).where(condition)
+            if cursor:
+                query = query.where(key > tuple_(*cursor) if newer else key < tuple_(*cursor))
+            candidates.append(select(query.order_by(*order).limit(limit).subquery()))
+        candidate_ids = union(*candidates).subquery()
+
+        query = select(chat_table).join(candidate_ids, candidate_ids.c.id == chat_table.id).order_by(*order).limit(limit)
+        messages = (await self._db.execute(query)).scalars().all()
+
+        return list(reversed(messages)) if newer else list(messages)
+
+    async def get_all_personal_chat_message(self, user_id: int, before: int = None, after: int = None, limit: int = 50):
+        db_user = await self.get_user_by_id(user_id)
+        if not db_user:
+            raise NotFoundError("User does not exist.")
+
+        return await self.get_chat_page([chat_table.sender_id == user_id, chat_table.receiver_id == user_id], before, after, limit)
+
+    # A single insert: the sender and receiver foreign keys already guarantee both users exist, so they are
+    # not looked up first. Callers that want a friendlier check up front can use known_user_ids.
+    async def create_personal_chat_message(self, sender_id: int, receiver_id: int, content: str):
+        if not content or len(content) == 0:
+            raise InvalidParameterError("Message content should not be empty.")
+
+        query = insert(chat_table).values(sender_id=sender_id, receiver_id=receiver_id, content=content).returning(chat_table)
+        try:
+            db_chat_instance = (await self._db.scalars(query)).one()
+            await self.update_conversations(db_chat_instance)
+            await self._db.commit()
+        except IntegrityError:
+            await self._db.rollback()
+            raise NotFoundError("Sender or receiver does not exist.")
+
+        return db_chat_instance
+
+    # Upserts both sides' conversation rows for a new chat in one statement, within the insert's transaction.
+    # Only the receiver's unread count goes up. Concurrent inserts may land out of order, so the last message
+    # columns only ever move to a newer message id.
+    async def update_conversations(self, chat):
+        rows = [{"user_id": chat.sender_id, "correspondent_id": chat.receiver_id, "unread_count": 0}]
+        if chat.receiver_id != chat.sender_id:
+            rows.append({"user_id": chat.receiver_id, "correspondent_id": chat.sender_id, "unread_count": 1})
+        for row in rows:
+            row.update(last_message_id=chat.id, last_message_content=chat.content, last_message_sender_id=chat.sender_id, last_message_at=chat.timestamp)
+
+        query = insert(conversation_table).values(rows)
+        is_newer = query.excluded.last_message_id > conversation_table.last_message_id
+        query = query.on_conflict_do_update(
+            index_elements=[conversation_table.user_id, conversation_table.correspondent_id],
+            set_={
+                "last_message_id": func.greatest(conversation_table.last_message_id, query.excluded.last_message_id),
+                "last_message_content": case((is_newer, query.excluded.last_message_content), else_=conversation_table.last_message_content),
+                "last_message_sender_id": case((is_newer, query.excluded.last_message_sender_id), else_=conversation_table.last_message_sender_id),
+                "last_message_at": case((is_newer, query.excluded.last_message_at), else_=conversation_table.last_message_at),
+                "unread_count": conversation_table.unread_count + query.excluded.unread_count,
+            })
+        await self._db.execute(query)
+
+    # Inbox page, most recent conversation first. Pass the last_message_id of the last conversation you have
+    # as `before` for the next page; every page is one range scan on ix_conversations_user_last_message.
+    async def get_conversations(self, user_id: int, before: int = None, limit: int = 20):
+        query = (
+            select(conversation_table, user_table.email)
+            .join(user_table, user_table.id == conversation_table.correspondent_id)
+            .where(conversation_table.user_id == user_id)
+            .order_by(conversation_table.last_message_id.desc())
+            .limit(limit)
+        )
+        if before:
+            query = query.where(conversation_table.last_message_id < before)
+
+        result = await self._db.execute(query)
+        return [{
+            "correspondent_id": conversation.correspondent_id,
+            "correspondent_email": email,
+            "last_message": {
+                "id": conversation.last_message_id,
+                "content": conversation.last_message_content,
+                "sender_id": conversation.last_message_sender_id,
+                "timestamp": conversation.last_message_at,
+            },
+            "unread_count": conversation.unread_count,
+        } for conversation, email in result.all()]
+
+    async def mark_conversation_read(self, user_id: int, correspondent_id: int):
+        query = update(conversation_table).where(conversation_table.user_id == user_id, conversation_table.correspondent_id == correspondent_id).values(unread_count=0)
+        response = await self._db.execute(query)
+        if response.rowcount == 0:
+            raise NotFoundError("Conversation does not exist.")
+        await self._db.commit()
+
+        return {"correspondent_id": correspondent_id, "unread_count": 0}
+
+    # Messages the user received that no device acknowledged yet, oldest first. One range scan on
+    # ix_chats_receiver_id, the cursor is read in the same statement.
+    async def get_undelivered_messages(self, user_id: int, limit: int):
+        last_delivered_id = select(delivery_cursor_table.last_delivered_id).where(delivery_cursor_table.user_id == user_id).scalar_subquery()
+        query = select(chat_table).where(chat_table.receiver_id == user_id, chat_table.id > func.coalesce(last_delivered_id, 0)).order_by(chat_table.id).limit(limit)
+        return (await self._db.scalars(query)).all()
+
+    # Cursors only move forward, acknowledgements arriving out of order cannot re-deliver older messages.
+    # first_id is the oldest message of a contiguous acknowledged range ending at message_id (a backlog batch,
+    # or a single live message). The cursor only moves when no received message between it and first_id is
+    # still unacknowledged, otherwise a live ack would skip an outstanding backlog; the acknowledged messages
+    # then come again with the next backlog. Without first_id everything up to message_id counts as acknowledged.
+    async def advance_delivery_cursor(self, user_id: int, message_id: int, first_id: int = None):
+        values = select(literal(user_id), literal(message_id))
+        if first_id is not None:
+            last_delivered_id = select(delivery_cursor_table.last_delivered_id).where(delivery_cursor_table.user_id == user_id).scalar_subquery()
+            outstanding = select(chat_table.id).where(chat_table.receiver_id == user_id, chat_table.id > func.coalesce(last_delivered_id, 0), chat_table.id < first_id)
+            values = values.where(~outstanding.exists())
+        query = insert(delivery_cursor_table).from_select(["user_id", "last_delivered_id"], values)
+        query = query.on_conflict_do_update(
+            index_elements=[delivery_cursor_table.user_id],
+            set_={"last_delivered_id": func.greatest(delivery_cursor_table.last_delivered_id, query.excluded.last_delivered_id)})
+        await self._db.execute(query)
+        await self._db.commit()
+
+    async def get_current_user_dms(self, current_user_id: int, correspondent_id: int, before: int = None, after: int = None, limit: int = 50):
+        db_correspondent = await self.get_user_by_id(correspondent_id)
+        if not db_correspondent:
+            raise NotFoundError("Correspondent does not exist.")
+
+        c_id = db_correspondent.id
+
+        return await self.get_chat_page([
+            and_(chat_table.sender_id == current_user_id, chat_table.receiver_id == c_id),
+            and_(chat_table.sender_id == c_id, chat_table.receiver_id == current_user_id)], before, after, limit)
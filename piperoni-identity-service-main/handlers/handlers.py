@@ -1,11 +1,11 @@
 from fastapi import Depends
-from handlers.db_handler import DBHandler
+from handlers.async_db_handler import AsyncDBHandler
 from services.current_user_service import CurrentUserService
-from database import get_db
+from database import get_async_db
 
-def get_db_handler(db=Depends(get_db)):
-    return DBHandler(db)
+def get_async_db_handler(db=Depends(get_async_db)):
+    return AsyncDBHandler(db)
 
 
-def get_current_user_service(db_handler=Depends(get_db_handler)):
+def get_current_user_service(db_handler=Depends(get_async_db_handler)):
     return CurrentUserService(db_handler)
\ No newline at end of file
@@ -1,15 +1,27 @@
 import uvicorn
 from fastapi import FastAPI, Depends, Request, HTTPException
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from database import engine, get_db
+from database import engine, get_db, get_pool_stats
+from auth.principal_cache import principal_cache, known_user_ids
+from services.catalog_cache import catalog_cache
+from services.recommender import bandmate_recommender
+from services.facet_index import facet_index
 from models import Base
 from routers import users, authentication, genre, instrument, personal_chat, files
 from sockets.server import sio_app
+from utils.file_streaming import UploadSizeLimitMiddleware
+from storage.legacy_media import import_legacy_media
 from preflight import genre_list, user_list, personal_genre_list, instrument_list, personal_instrument_list, personal_detail_list
 
 Base.metadata.create_all(bind=engine) # Create database tables on server start.
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse) # orjson renders responses, response_model routes skip jsonable_encoder entirely
+
+# Cut off oversized uploads while they are received, before they are spooled to disk.
+# Added before CORSMiddleware so CORS wraps it (the last added middleware is outermost) and its 413s
+# carry the CORS headers browsers need to read them.
+app.add_middleware(UploadSizeLimitMiddleware, limits=files.upload_size_limits)
 
 # Enable all origins for simplicity. Adjust as needed.
 app.add_middleware(
@@ -31,6 +43,11 @@ app.include_router(instrument.instrument_router)
 app.include_router(personal_chat.personal_chat_router)
 app.include_router(files.router)
 
+# Moves media uploaded before the media store (absolute /audio and /pics paths) into it
+@app.on_event("startup")
+async def import_legacy_media_on_startup():
+    await import_legacy_media()
+
 @app.middleware("http")
 async def reject_env_paths(request: Request, call_next):
     if ".env" in request.url.path:
@@ -43,6 +60,11 @@ async def index():
     return {"message": "Welcome to our backend server for our Flutter Project!"}
 
 
+@app.get("/stats/db_pool", description="Connection pool usage for this worker, used to tune DB_POOL_* settings against real load")
+async def db_pool_stats():
+    return {"data": get_pool_stats()}
+
+
 @app.get("/reset", description="This endpoint rebuilds database based on latest db schemas")
 async def reset(db_session=Depends(get_db)): # This endpoint will drop all db tables and recreate them in database from scratch and add default data. This is a hack so we don't need to do database migrations.
     Base.metadata.drop_all(bind=engine)
@@ -52,6 +74,11 @@ async def reset(db_session=Depends(get_db)): # This endpoint will drop all db ta
     for data in data_queue:
         db_session.bulk_save_objects(data)
     db_session.commit()
+    principal_cache.clear()
+    known_user_ids.clear()
+    catalog_cache.invalidate()
+    bandmate_recommender.invalidate()
+    facet_index.invalidate()
 
     return {"message": "Database has been rebuilt from scratch and initialized with default data."}
 
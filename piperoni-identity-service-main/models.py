@@ -1,5 +1,8 @@
-from sqlalchemy import Boolean, DateTime, Integer, String, ForeignKey, UniqueConstraint, ARRAY
-from sqlalchemy.orm import mapped_column, Mapped, relationship
+from sqlalchemy import Boolean, DateTime, Float, Integer, String, ForeignKey, UniqueConstraint, CheckConstraint, Index, Computed, event, text, inspect
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import mapped_column, Mapped, relationship, query_expression
+import logging
 from schemas import CollaborationPreference
 from database import Base
 from typing import List
@@ -30,9 +33,83 @@ class UserDetail(Base):
     address = mapped_column(String)
     profile_picture = mapped_column(String, nullable=True)
     audio_sample = mapped_column(String, nullable=True)
-    followers = mapped_column(ARRAY(Integer), nullable=True, default=[])
-    following = mapped_column(ARRAY(Integer), nullable=True, default=[])
+    # Optional location for in person matching. geohash is derived from latitude / longitude on every update
+    # (see utils/geohash.py); "C" collation keeps prefix matches on the plain btree index.
+    latitude = mapped_column(Float, nullable=True)
+    longitude = mapped_column(Float, nullable=True)
+    geohash = mapped_column(String(12, collation="C"), nullable=True, index=True)
     user: Mapped['User'] = relationship(back_populates="details")
+    # Follower / following user ids, read from the follows table by the queries that ask for them (with_expression),
+    # None everywhere else
+    followers = query_expression()
+    following = query_expression()
+
+    # Directory search columns, generated by postgres so they can never go stale. Deferred so they are never
+    # loaded into (and serialized from) regular queries.
+    # search_vector: weighted full text, name > title > description > address ('simple' config, names must not be stemmed)
+    # search_text: lowercased name, title and address for substring matching through the pg_trgm index
+    search_vector = mapped_column(TSVECTOR, Computed(
+        "setweight(to_tsvector('simple', coalesce(first_name, '') || ' ' || coalesce(last_name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(title, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(description, '')), 'C') || "
+        "setweight(to_tsvector('simple', coalesce(address, '')), 'D')", persisted=True), deferred=True)
+    search_text = mapped_column(String, Computed(
+        "lower(coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' || coalesce(title, '') || ' ' || coalesce(address, ''))", persisted=True), deferred=True)
+
+    __table_args__ = (
+        Index('ix_user_details_search_vector', 'search_vector', postgresql_using='gin'),
+    )
+
+
+# The trigram index needs the pg_trgm extension (part of postgres contrib, included in the official docker
+# image). Without it substring search still works, only without an index.
+@event.listens_for(UserDetail.__table__, "after_create")
+def create_search_text_trigram_index(target, connection, **kw):
+    if not connection.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first():
+        logging.getLogger(__name__).warning("pg_trgm is not available, user_details.search_text is not indexed.")
+        return
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_user_details_search_text_trgm ON user_details USING gin (search_text gin_trgm_ops)"))
+
+
+# Follow graph, one row per edge. The primary key makes follow/unfollow idempotent single-row writes
+# and serves "who does X follow", the followee index serves "who follows X".
+class Follow(Base):
+    __tablename__ = "follows"
+    follower_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    followee_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        CheckConstraint('follower_id <> followee_id', name='no_self_follow'),
+        Index('ix_follows_followee_follower', 'followee_id', 'follower_id'),
+    )
+
+
+# One time copy of the follow graph out of the user_details.followers / following arrays it used to live in.
+# create_all never drops those columns, so they still exist on databases created before the follows table.
+@event.listens_for(Follow.__table__, "after_create")
+def backfill_follows_from_user_details(target, connection, **kw):
+    legacy_columns = {row[0] for row in connection.execute(text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'user_details' AND column_name IN ('followers', 'following')"))}
+    edges = []
+    if "following" in legacy_columns:
+        edges.append("SELECT user_id AS follower_id, unnest(following) AS followee_id FROM user_details")
+    if "followers" in legacy_columns:
+        edges.append("SELECT unnest(followers) AS follower_id, user_id AS followee_id FROM user_details")
+    if not edges:
+        return
+
+    result = connection.execute(text(
+        "INSERT INTO follows (follower_id, followee_id, created_at) "
+        "SELECT edges.follower_id, edges.followee_id, timezone('utc', now()) "
+        f"FROM ({' UNION '.join(edges)}) AS edges "
+        "JOIN users AS follower ON follower.id = edges.follower_id "
+        "JOIN users AS followee ON followee.id = edges.followee_id "
+        "WHERE edges.follower_id <> edges.followee_id "
+        "ON CONFLICT DO NOTHING"))
+    logging.getLogger(__name__).warning("Copied %s follow edges from user_details into follows.", result.rowcount)
 
 
 class Genre(Base):
@@ -81,4 +158,108 @@ class Chat(Base):
     receiver_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'))
 
     sender: Mapped[User] = relationship('User', foreign_keys=[sender_id])
-    receiver: Mapped[User] = relationship('User', foreign_keys=[receiver_id])
\ No newline at end of file
+    receiver: Mapped[User] = relationship('User', foreign_keys=[receiver_id])
+
+    # Chat history is paged newest first with a (timestamp, id) keyset, so each page is an index range scan:
+    # one conversation direction, everything a user sent and everything a user received.
+    __table_args__ = (
+        Index('ix_chats_sender_receiver_timestamp', 'sender_id', 'receiver_id', 'timestamp', 'id'),
+        Index('ix_chats_sender_timestamp', 'sender_id', 'timestamp', 'id'),
+        Index('ix_chats_receiver_timestamp', 'receiver_id', 'timestamp', 'id'),
+        # undelivered backlog of a user: receiver_id = ? AND id > last delivered id, in id order
+        Index('ix_chats_receiver_id', 'receiver_id', 'id'),
+    )
+
+
+# One row per (user, correspondent) pair and direction of view, kept up to date by every chat insert, so the
+# inbox is a page of this table instead of a scan over the whole chat history.
+class Conversation(Base):
+    __tablename__ = "conversations"
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    correspondent_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    last_message_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    last_message_content: Mapped[str] = mapped_column(String(length=100))
+    last_message_sender_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    last_message_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+    unread_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+    # inbox pages: newest conversation first, keyset on the last message id
+    __table_args__ = (
+        Index('ix_conversations_user_last_message', 'user_id', 'last_message_id'),
+    )
+
+
+# Builds the inbox from the chat history when the table is created on a database that already has chats.
+# Chats carry no read state, so a conversation counts what the user received after their own last message in it
+# as unread (replying means the earlier messages were read). create_all may create this table before chats, in
+# which case there is nothing to backfill.
+@event.listens_for(Conversation.__table__, "after_create")
+def backfill_conversations_from_chats(target, connection, **kw):
+    if connection.execute(text("SELECT to_regclass('chats')")).scalar() is None:
+        return
+
+    result = connection.execute(text(
+        "WITH views AS ("
+        " SELECT sender_id AS user_id, receiver_id AS correspondent_id, id, content, sender_id, timestamp FROM chats"
+        " UNION ALL"
+        " SELECT receiver_id, sender_id, id, content, sender_id, timestamp FROM chats WHERE receiver_id <> sender_id) "
+        "INSERT INTO conversations (user_id, correspondent_id, last_message_id, last_message_content, last_message_sender_id, last_message_at, unread_count) "
+        "SELECT DISTINCT ON (views.user_id, views.correspondent_id) views.user_id, views.correspondent_id, views.id, views.content, views.sender_id, "
+        "coalesce(views.timestamp, timezone('utc', now())), "
+        "(SELECT count(*) FROM chats AS received WHERE received.sender_id = views.correspondent_id AND received.receiver_id = views.user_id "
+        " AND views.user_id <> views.correspondent_id"
+        " AND received.id > coalesce((SELECT max(sent.id) FROM chats AS sent WHERE sent.sender_id = views.user_id AND sent.receiver_id = views.correspondent_id), 0)) "
+        "FROM views "
+        "ORDER BY views.user_id, views.correspondent_id, views.id DESC "
+        "ON CONFLICT DO NOTHING"))
+    if result.rowcount:
+        logging.getLogger(__name__).warning("Backfilled %s conversations from chats.", result.rowcount)
+
+
+# How far socket delivery of direct messages has got for each user. Every chat a user received with an id
+# above last_delivered_id has not been acknowledged by any of their devices yet.
+class DeliveryCursor(Base):
+    __tablename__ = "delivery_cursors"
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    last_delivered_id: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+# Databases that had chats before delivery cursors existed: every message already sent counts as delivered,
+# otherwise each user's first connect would push their whole chat history as backlog. create_all may create
+# this table before chats, in which case there is nothing to seed.
+@event.listens_for(DeliveryCursor.__table__, "after_create")
+def seed_delivery_cursors(target, connection, **kw):
+    if connection.execute(text("SELECT to_regclass('chats')")).scalar() is None:
+        return
+
+    result = connection.execute(text(
+        "INSERT INTO delivery_cursors (user_id, last_delivered_id) "
+        "SELECT users.id, (SELECT max(id) FROM chats) FROM users "
+        "WHERE EXISTS (SELECT 1 FROM chats) "
+        "ON CONFLICT DO NOTHING"))
+    if result.rowcount:
+        logging.getLogger(__name__).warning("Seeded %s delivery cursors at the latest chat.", result.rowcount)
+
+
+# create_all only creates missing tables, it never changes one that exists. Columns and indexes added to these
+# tables after they were first deployed are created here instead, on every start; both steps are no-ops once done.
+upgraded_tables = [UserDetail.__table__, Chat.__table__]
+
+
+def add_missing_columns(connection, table) -> bool:
+    existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    missing = [column for column in table.columns if column.name not in existing]
+    for column in missing:
+        connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {CreateColumn(column).compile(dialect=connection.dialect)}"))
+    if missing:
+        logging.getLogger(__name__).warning("Added columns %s to %s.", ", ".join(column.name for column in missing), table.name)
+    return bool(missing)
+
+
+@event.listens_for(Base.metadata, "after_create")
+def upgrade_existing_tables(target, connection, **kw):
+    for table in upgraded_tables:
+        added = add_missing_columns(connection, table)
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+        if added and table is UserDetail.__table__:
+            create_search_text_trigram_index(table, connection)
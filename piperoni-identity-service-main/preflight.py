@@ -84,9 +84,9 @@ personal_instrument_list = [
 
 
 personal_detail_list = [
-    UserDetail(user_id=1, title="Music Producer", description="Hello, my name is Rishabh. I am a college student at UCSB.", preference=CollaborationPreference.no_preference, address="Santa Barbara, CA 93106", first_name="Rishabh", last_name="Poikayil", followers=list(), following=list()),
-    UserDetail(user_id=2, title="Guitarist", description="Hello, my name is Leon. I am a college student at UCSB.", preference=CollaborationPreference.in_person, address="Santa Barbara, CA 93106", first_name="Leon", last_name="Feng", followers=list(), following=list()),
-    UserDetail(user_id=3, title="Pianist", description="Hello, my name is Aviv. I am a college student at UCSB.", preference=CollaborationPreference.online, address="Santa Barbara, CA 93106",  first_name="Aviv", last_name="Samet", followers=list(), following=list()),
-    UserDetail(user_id=4, title="Pianist", description="Hello, my name is Kirill. I am a college student at UCSB.", preference=CollaborationPreference.in_person, address="Santa Barbara, CA 93106", first_name="Kirill", last_name="Aristarkhov", followers=list(), following=list()),
-    UserDetail(user_id=5, title="Music Producer", description="Hello, my name is Andy. I am a college student at UCSB.", preference=CollaborationPreference.in_person, address="Santa Barbara, CA 93106", first_name="Andy", last_name="Gonzalez", followers=list(), following=list())
+    UserDetail(user_id=1, title="Music Producer", description="Hello, my name is Rishabh. I am a college student at UCSB.", preference=CollaborationPreference.no_preference, address="Santa Barbara, CA 93106", first_name="Rishabh", last_name="Poikayil"),
+    UserDetail(user_id=2, title="Guitarist", description="Hello, my name is Leon. I am a college student at UCSB.", preference=CollaborationPreference.in_person, address="Santa Barbara, CA 93106", first_name="Leon", last_name="Feng"),
+    UserDetail(user_id=3, title="Pianist", description="Hello, my name is Aviv. I am a college student at UCSB.", preference=CollaborationPreference.online, address="Santa Barbara, CA 93106",  first_name="Aviv", last_name="Samet"),
+    UserDetail(user_id=4, title="Pianist", description="Hello, my name is Kirill. I am a college student at UCSB.", preference=CollaborationPreference.in_person, address="Santa Barbara, CA 93106", first_name="Kirill", last_name="Aristarkhov"),
+    UserDetail(user_id=5, title="Music Producer", description="Hello, my name is Andy. I am a college student at UCSB.", preference=CollaborationPreference.in_person, address="Santa Barbara, CA 93106", first_name="Andy", last_name="Gonzalez")
 ]
\ No newline at end of file
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from auth.auth_token import create_access_token, oauth2_scheme, SECRET_KEY, ALGORITHM
+from auth.principal_cache import principal_cache
 from jose import jwt, JWTError
 from schemas import User, Token, GoogleSignInAccount
-from handlers.handlers import get_db_handler
-from exception import InvalidParameterError, AlreadyExistsError
+from handlers.handlers import get_async_db_handler
+from exception import InvalidParameterError, AlreadyExistsError, ServiceBusyError
 from fastapi.security import OAuth2PasswordRequestForm
 from typing import Annotated
 from datetime import timedelta
@@ -56,7 +57,7 @@ def decode_apple_user_token(apple_user_token):
 # Helper function to verify if the incoming HTTP has the valid JWT as the bearer token.
 # A JWT is valid if it is not expired and can be correctly decoded and match with our database data.
 # JWT is signed by a secret key and should be keep safe.
-def get_current_user(token: str = Depends(oauth2_scheme), db_handler=Depends(get_db_handler)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db_handler=Depends(get_async_db_handler)):
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
@@ -70,21 +71,31 @@ def get_current_user(token: str = Depends(oauth2_scheme), db_handler=Depends(get
         except JWTError:
             raise credentials_exception
         
-        user = db_handler.get_user_by_email(payload.get("sub"))
+        # The token signature and expiry are checked above on every request, only the db lookup is cached
+        user_email = user_email.strip()
+        user = principal_cache.get(user_email)
+        if user:
+            return user
+
+        user = await db_handler.get_user_by_email(user_email)
         if not user:
             raise credentials_exception
+
+        principal_cache.set(user_email, user, expires_at=payload.get("exp"))
     
         return user
 
 
 @authentication_router.post("/signup", status_code=status.HTTP_201_CREATED)
-async def create_new_user(user: User, db_handler=Depends(get_db_handler)):
+async def create_new_user(user: User, db_handler=Depends(get_async_db_handler)):
     try:
-        db_handler.create_user(user, False)
+        await db_handler.create_user(user, False)
     except InvalidParameterError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
     except AlreadyExistsError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+    except ServiceBusyError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
     
     return  {
         "status": "OK",
@@ -93,8 +104,11 @@ async def create_new_user(user: User, db_handler=Depends(get_db_handler)):
 
 
 @authentication_router.post("/token", status_code=status.HTTP_200_OK, response_model=Token)
-async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db_handler=Depends(get_db_handler)):
-    user = db_handler.authenticate_user(form_data.username, form_data.password)
+async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db_handler=Depends(get_async_db_handler)):
+    try:
+        user = await db_handler.authenticate_user(form_data.username, form_data.password)
+    except ServiceBusyError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -113,7 +127,7 @@ async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm,
 # 1. If user already created an account via custom auth, then user can use oauth with the same email to login as well.
 # 2. If user does not have an account, then sign in using oauth for the first time, we will create an account using oauth info, and user will not be able to login using custom auth.
 @authentication_router.post("/google_oauth", status_code=status.HTTP_200_OK)
-async def google_login_for_access_token(auth_instance: GoogleSignInAccount, db_handler=Depends(get_db_handler)):
+async def google_login_for_access_token(auth_instance: GoogleSignInAccount, db_handler=Depends(get_async_db_handler)):
     try:
         user_id_token = auth_instance.id_token
         if not user_id_token or len(user_id_token) == 0:
@@ -149,15 +163,17 @@ async def google_login_for_access_token(auth_instance: GoogleSignInAccount, db_h
             )
         
         user_email = data["email"]
-        db_user = db_handler.get_user_by_email(user_email)
+        db_user = await db_handler.get_user_by_email(user_email)
         if not db_user: # user first sign in using google oauth2
             # register user in our database
             # Be aware: this password is not usable since oauth2 user cannot be signed in using password
             user = User(email=user_email, password="randompasswordthatdoesnotmatter1234567")
-            db_handler.create_user(user, True)
+            await db_handler.create_user(user, True)
 
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(data={"sub": data["email"]}, expires_delta=access_token_expires)
+    except ServiceBusyError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
     except Exception as _:
         raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
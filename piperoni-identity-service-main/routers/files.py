@@ -1,120 +1,155 @@
-import os
-
-from fastapi import APIRouter, UploadFile, Depends, HTTPException, status, Response
+import asyncio
+from collections import deque
+from itertools import islice
+from typing import List
+from uuid import uuid4
+
+from fastapi import APIRouter, UploadFile, BackgroundTasks, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 from routers.authentication import get_current_user
-from handlers.handlers import get_db_handler
-import requests
+from handlers.handlers import get_async_db_handler
+from starlette.concurrency import run_in_threadpool
+from utils.file_streaming import stream_media_response, save_upload_file, bytes_response, is_pinned_to, PINNED_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL
+from utils.image_variants import generate_variants, variant_key, get_default_avatar, VARIANT_MEDIA_TYPE
+from storage.media_store import media_store
+from schemas import ProfilePictureSize
+from db_config import settings
 
 router = APIRouter(prefix="/api/files", tags=["files"])
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+IMAGE_MEDIA_TYPES = {'png': "image/png", 'jpg': "image/jpeg", 'jpeg': "image/jpeg"}
+
+# Request body limits for UploadSizeLimitMiddleware, the file limit plus room for the multipart framing
+upload_size_limits = {
+    "/api/files/upload_audio": settings.MAX_AUDIO_UPLOAD_BYTES + settings.UPLOAD_FORM_OVERHEAD_BYTES,
+    "/api/files/upload": settings.MAX_IMAGE_UPLOAD_BYTES + settings.UPLOAD_FORM_OVERHEAD_BYTES,
+}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def image_media_type(key: str):
+    return IMAGE_MEDIA_TYPES.get(key.rsplit('.', 1)[-1], "image/png")
+
 @router.post("/upload_audio")
-async def upload_audio_file(file: UploadFile, current_user=Depends(get_current_user), db_handler=Depends(get_db_handler)):
+async def upload_audio_file(file: UploadFile, current_user=Depends(get_current_user), db_handler=Depends(get_async_db_handler)):
     if file.content_type != "audio/mpeg":
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File must be an mp3 audio file.")
-    contents = await file.read()
-    filepath = f"/audio/{current_user.id}.mp3"
 
-    # Have to try to create the directory first
-    # https://stackoverflow.com/questions/23793987/write-a-file-to-a-directory-that-doesnt-exist
     try:
-        os.makedirs(os.path.dirname(filepath))
-    except FileExistsError:
-        pass
-    except Exception as e:
+        key = await save_upload_file(file, "mp3", settings.MAX_AUDIO_UPLOAD_BYTES)
+    except OSError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)) from e
 
-    with open(filepath, "wb") as f:
-        f.write(contents)
+    await db_handler.update_current_user_personal_details_fields("audio_sample", key, current_user.id)
 
-    db_handler.update_current_user_personal_details_fields("audio_sample", filepath, current_user.id)
-
-    return {"filepath": filepath}
+    return {"filepath": key}
 
 @router.get("/audio/{user_id}")
-def get_audio_file(user_id: int, db_handler=Depends(get_db_handler)):
-    user_details = db_handler.get_current_user_personal_details(user_id)
+async def get_audio_file(user_id: int, request: Request, db_handler=Depends(get_async_db_handler)):
+    user_details = await db_handler.get_current_user_personal_details(user_id)
     if not user_details:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User details not found.")
     if not user_details.audio_sample:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User audio sample not found.")
     
-    audio_file = open(user_details.audio_sample, "rb")
-
-    audio_bytes = audio_file.read()
-
-    return Response(content=audio_bytes, media_type="audio/mpeg")
+    cache_control = PINNED_CACHE_CONTROL if is_pinned_to(request, user_details.audio_sample) else REVALIDATE_CACHE_CONTROL
+    return await stream_media_response(request, user_details.audio_sample, "audio/mpeg", cache_control)
 
 @router.post("/upload")
-async def upload_file(file: UploadFile, current_user=Depends(get_current_user), db_handler=Depends(get_db_handler)):
+async def upload_file(file: UploadFile, background_tasks: BackgroundTasks, current_user=Depends(get_current_user), db_handler=Depends(get_async_db_handler)):
     # Check if the file has an allowed extension
     if not allowed_file(file.filename):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST) 
-    contents = await file.read()
-    filepath = f"/pics/{current_user.id}.png"
+    extension = file.filename.rsplit('.', 1)[1].lower()
 
-    # Have to try to create the directory first
-    # https://stackoverflow.com/questions/23793987/write-a-file-to-a-directory-that-doesnt-exist
     try:
-        os.makedirs(os.path.dirname(filepath))
-    except FileExistsError:
-        pass
-    except Exception as e:
+        key = await save_upload_file(file, "jpg" if extension == "jpeg" else extension, settings.MAX_IMAGE_UPLOAD_BYTES)
+    except OSError as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)) from e
 
-    with open(filepath, "wb") as f:
-        f.write(contents)
+    # A new picture is a new key, so the old picture and its variants are never served for it
+    await db_handler.update_current_user_personal_details_fields("profile_picture", key, current_user.id)
+    # Resizing runs after the response is sent
+    background_tasks.add_task(generate_variants, key)
 
-    db_handler.update_current_user_personal_details_fields("profile_picture", filepath, current_user.id)
+    return {"filepath": key}
 
-    return {"filepath": filepath}
 
-@router.get("/profile")
-def get_profile_pic(current_user=Depends(get_current_user), db_handler=Depends(get_db_handler)):
-    user_details = db_handler.get_current_user_personal_details(current_user.id)
-    if not user_details:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User details not found.")
+# pinnable: the route is public, so a variant requested with the picture's v= may be cached for good. The original,
+# served only until the resize finishes, never is, or the pinned URL would keep it instead of the variant.
+async def profile_picture_response(request: Request, user_details, size: ProfilePictureSize, pinnable: bool = False):
     if not user_details.profile_picture:
-        default_pfp_req = requests.get('https://zultimate.com/wp-content/uploads/2019/12/default-profile.png')
-        return Response(content=default_pfp_req.content, media_type="image/png")
-    
-    picture_file = open(user_details.profile_picture, "rb")
+        default_pfp = await run_in_threadpool(get_default_avatar, size)
+        return bytes_response(request, default_pfp, VARIANT_MEDIA_TYPE)
 
-    picture_bytes = picture_file.read()
+    # Until the background resize finishes only the original upload exists
+    resized_key = variant_key(user_details.profile_picture, size)
+    if await media_store.exists(resized_key):
+        pinned = pinnable and is_pinned_to(request, user_details.profile_picture)
+        return await stream_media_response(request, resized_key, VARIANT_MEDIA_TYPE, PINNED_CACHE_CONTROL if pinned else REVALIDATE_CACHE_CONTROL)
 
-    return Response(content=picture_bytes, media_type="image/png")
-    
-@router.get("/profile/{user_id}")
-def get_profile_pic_by_id(user_id: int, db_handler=Depends(get_db_handler)):
-    user_details = db_handler.get_current_user_personal_details(user_id)
+    return await stream_media_response(request, user_details.profile_picture, image_media_type(user_details.profile_picture))
+
+
+@router.get("/profile")
+async def get_profile_pic(request: Request, size: ProfilePictureSize = ProfilePictureSize.full, current_user=Depends(get_current_user), db_handler=Depends(get_async_db_handler)):
+    user_details = await db_handler.get_current_user_personal_details(current_user.id)
     if not user_details:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User details not found.")
-    if not user_details.profile_picture:
-        default_pfp_req = requests.get('https://zultimate.com/wp-content/uploads/2019/12/default-profile.png')
-        return Response(content=default_pfp_req.content, media_type="image/png")
     
-    picture_file = open(user_details.profile_picture, "rb")
-
-    picture_bytes = picture_file.read()
-
-    return Response(content=picture_bytes, media_type="image/png")
+    return await profile_picture_response(request, user_details, size)
+    
+# Only the small resized variant is ever sent. While it doesn't exist (the background resize hasn't finished, or the
+# upload could not be decoded) the part is the default avatar rather than the original, which can be 10 MB.
+async def read_avatar_part(user_id: int, profile_picture, size: ProfilePictureSize):
+    if profile_picture:
+        try:
+            return user_id, VARIANT_MEDIA_TYPE, await media_store.read(variant_key(profile_picture, size))
+        except FileNotFoundError:
+            pass
+
+    return user_id, VARIANT_MEDIA_TYPE, await run_in_threadpool(get_default_avatar, size)
+
+
+async def iter_avatar_parts(pictures, size: ProfilePictureSize, boundary: str):
+    # Parts are written in request order while the next AVATAR_BATCH_CONCURRENCY files are read concurrently. A new
+    # read starts only when a part has been yielded, so at most that many finished parts wait in memory.
+    pending = deque()
+    pictures = iter(pictures)
+    try:
+        for user_id, profile_picture in islice(pictures, settings.AVATAR_BATCH_CONCURRENCY):
+            pending.append(asyncio.create_task(read_avatar_part(user_id, profile_picture, size)))
+
+        while pending:
+            user_id, media_type, content = await pending.popleft()
+            headers = f"--{boundary}\r\nContent-Type: {media_type}\r\nContent-Length: {len(content)}\r\nX-User-Id: {user_id}\r\n\r\n"
+            yield headers.encode() + content + b"\r\n"
+            for user_id, profile_picture in islice(pictures, 1):
+                pending.append(asyncio.create_task(read_avatar_part(user_id, profile_picture, size)))
+        yield f"--{boundary}--\r\n".encode()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+# Avatars for a whole screen in one round trip, e.g. /api/files/profile/batch?ids=1&ids=2&ids=3
+# The response is multipart/mixed, one part per requested id (in request order) with an X-User-Id header.
+# Users without a picture, without personal details or whose picture is still being resized get the default avatar.
+@router.get("/profile/batch")
+async def get_profile_pics_batch(ids: List[int] = Query(..., max_length=100), size: ProfilePictureSize = ProfilePictureSize.thumbnail, db_handler=Depends(get_async_db_handler)):
+    user_ids = list(dict.fromkeys(ids)) # drop duplicates, keep order
+    profile_pictures = await db_handler.get_profile_pictures(user_ids)
+    pictures = [(user_id, profile_pictures.get(user_id)) for user_id in user_ids]
+
+    boundary = uuid4().hex
+    return StreamingResponse(iter_avatar_parts(pictures, size, boundary), media_type=f"multipart/mixed; boundary={boundary}")
 
 
-@router.get("/profile/all")
-def get_all_profile_pics(db_handler=Depends(get_db_handler)):
-    user_details = db_handler.get_all_user_personal_details()
+@router.get("/profile/{user_id}")
+async def get_profile_pic_by_id(user_id: int, request: Request, size: ProfilePictureSize = ProfilePictureSize.full, db_handler=Depends(get_async_db_handler)):
+    user_details = await db_handler.get_current_user_personal_details(user_id)
     if not user_details:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User details not found.")
     
-    pictures = []
-    for user in user_details:
-        if not user.profile_picture:
-            continue
-        picture_file = open(user.profile_picture, "rb")
-        picture_bytes = picture_file.read()
-        pictures.append(picture_bytes)
-
-    return Response(content=pictures, media_type="image/png")
+    return await profile_picture_response(request, user_details, size, pinnable=True)
@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from handlers.handlers import get_db_handler, get_current_user_service
+from handlers.handlers import get_async_db_handler, get_current_user_service
 from routers.authentication import get_current_user
 from exception import  AppError, NotFoundError
-from schemas import Genre, User, PersonalGenresUpload
+from schemas import Genre, User, PersonalGenresUpload, MessagesResponse, MessageResponse, UserPayload, CatalogItemOut, SelectableCatalogItemOut, PersonalGenreOut, PersonalTagSetOut
+from typing import List
 
 genre_router = APIRouter(
     prefix="/api/genres",
@@ -10,10 +11,10 @@ genre_router = APIRouter(
 )
 
 
-@genre_router.get("/all", status_code=status.HTTP_200_OK)
-async def get_all_genres(db_handler=Depends(get_db_handler)):
+@genre_router.get("/all", status_code=status.HTTP_200_OK, response_model=MessagesResponse[List[CatalogItemOut]])
+async def get_all_genres(db_handler=Depends(get_async_db_handler)):
     try:
-        genre_list = db_handler.get_all_music_genres()
+        genre_list = await db_handler.get_all_music_genres()
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -23,11 +24,11 @@ async def get_all_genres(db_handler=Depends(get_db_handler)):
     }
 
 
-@genre_router.get("/me", status_code=status.HTTP_200_OK)
+@genre_router.get("/me", status_code=status.HTTP_200_OK, response_model=MessagesResponse[UserPayload[List[SelectableCatalogItemOut]]])
 async def get_personal_genres(current_user_service = Depends(get_current_user_service), current_user = Depends(get_current_user)):
     try:
         current_user_id = current_user.id
-        db_personal_list = current_user_service.fetch_current_user_personal_genres(current_user_id)
+        db_personal_list = await current_user_service.fetch_current_user_personal_genres(current_user_id)
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -37,10 +38,10 @@ async def get_personal_genres(current_user_service = Depends(get_current_user_se
     }
 
 
-@genre_router.get("/{genre_name}", status_code=status.HTTP_200_OK)
-async def get_genre_by_name(genre_name: str, db_handler=Depends(get_db_handler), current_user = Depends(get_current_user)):
+@genre_router.get("/{genre_name}", status_code=status.HTTP_200_OK, response_model=MessageResponse[CatalogItemOut])
+async def get_genre_by_name(genre_name: str, db_handler=Depends(get_async_db_handler), current_user = Depends(get_current_user)):
     try:
-        db_genre = db_handler.get_genre_by_name(genre_name)
+        db_genre = await db_handler.get_genre_by_name(genre_name)
         if not db_genre:
             raise NotFoundError("Genre does not exist")
     except NotFoundError as e:
@@ -52,10 +53,10 @@ async def get_genre_by_name(genre_name: str, db_handler=Depends(get_db_handler),
     }
 
 
-@genre_router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_genre(genre: Genre, db_handler=Depends(get_db_handler), current_user = Depends(get_current_user)):
+@genre_router.post("/", status_code=status.HTTP_201_CREATED, response_model=MessagesResponse[CatalogItemOut])
+async def create_genre(genre: Genre, db_handler=Depends(get_async_db_handler), current_user = Depends(get_current_user)):
     try:
-        db_genre = db_handler.create_genre(genre)
+        db_genre = await db_handler.create_genre(genre)
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -66,9 +67,9 @@ async def create_genre(genre: Genre, db_handler=Depends(get_db_handler), current
 
 
 @genre_router.delete("/{genre_name}", status_code=status.HTTP_200_OK)
-async def delete_genre(genre_name: str, db_handler=Depends(get_db_handler), current_user = Depends(get_current_user)):
+async def delete_genre(genre_name: str, db_handler=Depends(get_async_db_handler), current_user = Depends(get_current_user)):
     try:
-        db_handler.delete_genre_by_name(genre_name)
+        await db_handler.delete_genre_by_name(genre_name)
     except NotFoundError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
     
@@ -79,10 +80,10 @@ async def delete_genre(genre_name: str, db_handler=Depends(get_db_handler), curr
 
 
 @genre_router.delete("/me/{genre_id}", status_code=status.HTTP_200_OK)
-async def delete_personal_genre(genre_id: int, db_handler=Depends(get_db_handler), current_user = Depends(get_current_user)):
+async def delete_personal_genre(genre_id: int, db_handler=Depends(get_async_db_handler), current_user = Depends(get_current_user)):
     try:
         current_user_id = current_user.id
-        db_handler.delete_current_user_genre(current_user_id, genre_id)
+        await db_handler.delete_current_user_genre(current_user_id, genre_id)
     except NotFoundError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
     
@@ -92,16 +93,35 @@ async def delete_personal_genre(genre_id: int, db_handler=Depends(get_db_handler
     }
 
 
-@genre_router.post("/me", status_code=status.HTTP_201_CREATED)
-async def create_personal_genres(personal_genres: PersonalGenresUpload, db_handler=Depends(get_db_handler), current_user: User = Depends(get_current_user)):
+# Adds genres to the current user, genres they already have are skipped. Returns the newly added rows.
+@genre_router.post("/me", status_code=status.HTTP_201_CREATED, response_model=MessagesResponse[UserPayload[List[PersonalGenreOut]]])
+async def create_personal_genres(personal_genres: PersonalGenresUpload, db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
     try:
         current_user_id = current_user.id
         genre_id_list = personal_genres.id
-        db_genre = db_handler.create_current_user_genres(genre_id_list, current_user_id)
+        db_genre = await db_handler.create_current_user_genres(genre_id_list, current_user_id)
+    except NotFoundError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     return {
         "data": {"user": current_user.email, "payload": db_genre},
         "messages": f"SUCCESS: genre created for current user."
+    }
+
+
+# Replaces the current user's genres with exactly the given set, e.g. when the profile editor is saved
+@genre_router.put("/me", status_code=status.HTTP_200_OK, response_model=MessagesResponse[UserPayload[PersonalTagSetOut]])
+async def replace_personal_genres(personal_genres: PersonalGenresUpload, db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
+    try:
+        result = await db_handler.replace_current_user_genres(personal_genres.id, current_user.id)
+    except NotFoundError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return {
+        "data": {"user": current_user.email, "payload": result},
+        "messages": "SUCCESS: genres replaced for current user."
     }
\ No newline at end of file
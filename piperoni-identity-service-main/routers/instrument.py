@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from handlers.handlers import get_db_handler, get_current_user_service
+from handlers.handlers import get_async_db_handler, get_current_user_service
 from routers.authentication import get_current_user
 from exception import  AppError, NotFoundError, AlreadyExistsError
-from schemas import Instrument, User, PersonalInstrumentsUpload
+from schemas import Instrument, User, PersonalInstrumentsUpload, MessagesResponse, UserPayload, CatalogItemOut, SelectableCatalogItemOut, PersonalInstrumentOut, PersonalTagSetOut
 from typing import List
 
 instrument_router = APIRouter(
@@ -10,10 +10,10 @@ instrument_router = APIRouter(
     tags=["instruments"]
 )
 
-@instrument_router.get("/all", status_code=status.HTTP_200_OK)
-async def get_all_instruments(db_handler=Depends(get_db_handler)):
+@instrument_router.get("/all", status_code=status.HTTP_200_OK, response_model=MessagesResponse[List[CatalogItemOut]])
+async def get_all_instruments(db_handler=Depends(get_async_db_handler)):
     try:
-        instrument_list = db_handler.get_all_instruments()
+        instrument_list = await db_handler.get_all_instruments()
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -22,11 +22,11 @@ async def get_all_instruments(db_handler=Depends(get_db_handler)):
         "messages": f"SUCCESS: {len(instrument_list)} instruments retrieved."
     }
 
-@instrument_router.get("/me", status_code=status.HTTP_201_CREATED)
+@instrument_router.get("/me", status_code=status.HTTP_201_CREATED, response_model=MessagesResponse[UserPayload[List[SelectableCatalogItemOut]]])
 async def get_current_user_instruments(current_user_service=Depends(get_current_user_service), current_user: User=Depends(get_current_user)):
     try:
         current_user_id = current_user.id
-        result = current_user_service.fetch_current_user_personal_instruments(current_user_id)
+        result = await current_user_service.fetch_current_user_personal_instruments(current_user_id)
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -36,10 +36,10 @@ async def get_current_user_instruments(current_user_service=Depends(get_current_
     }
 
 
-@instrument_router.get("/{instrument_name}", status_code=status.HTTP_200_OK)
-async def get_instrument_by_name(instrument_name: str, db_handler=Depends(get_db_handler), current_user: User=Depends(get_current_user)):
+@instrument_router.get("/{instrument_name}", status_code=status.HTTP_200_OK, response_model=MessagesResponse[CatalogItemOut])
+async def get_instrument_by_name(instrument_name: str, db_handler=Depends(get_async_db_handler), current_user: User=Depends(get_current_user)):
     try:
-        db_instrument = db_handler.get_instrument_by_name(instrument_name)
+        db_instrument = await db_handler.get_instrument_by_name(instrument_name)
         if not db_instrument:
             raise NotFoundError("instrument not found")
     except NotFoundError as e:
@@ -53,10 +53,10 @@ async def get_instrument_by_name(instrument_name: str, db_handler=Depends(get_db
     }
     
 
-@instrument_router.post("", status_code=status.HTTP_201_CREATED)
-async def create_instrument(instrument: Instrument, db_handler=Depends(get_db_handler), current_user: User=Depends(get_current_user)):
+@instrument_router.post("", status_code=status.HTTP_201_CREATED, response_model=MessagesResponse[CatalogItemOut])
+async def create_instrument(instrument: Instrument, db_handler=Depends(get_async_db_handler), current_user: User=Depends(get_current_user)):
     try:
-        db_instrument = db_handler.create_instrument(instrument)
+        db_instrument = await db_handler.create_instrument(instrument)
     except AlreadyExistsError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
     except AppError as e:
@@ -69,9 +69,9 @@ async def create_instrument(instrument: Instrument, db_handler=Depends(get_db_ha
 
 
 @instrument_router.delete("/{instrument_name}", status_code=status.HTTP_200_OK)
-async def delete_instrument_by_name(instrument_name: str, db_handler=Depends(get_db_handler), current_user: User=Depends(get_current_user)):
+async def delete_instrument_by_name(instrument_name: str, db_handler=Depends(get_async_db_handler), current_user: User=Depends(get_current_user)):
     try:
-        db_handler.delete_instrument_by_name(instrument_name)
+        await db_handler.delete_instrument_by_name(instrument_name)
     except NotFoundError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
     except AppError as e:
@@ -83,10 +83,10 @@ async def delete_instrument_by_name(instrument_name: str, db_handler=Depends(get
     }
 
 @instrument_router.delete("/me/{instrument_id}", status_code=status.HTTP_200_OK)
-async def delete_current_user_personal_instrument_by_id(instrument_id: int, db_handler=Depends(get_db_handler), current_user: User=Depends(get_current_user)):
+async def delete_current_user_personal_instrument_by_id(instrument_id: int, db_handler=Depends(get_async_db_handler), current_user: User=Depends(get_current_user)):
     try:
         current_user_id = current_user.id
-        db_handler.delete_current_user_instrument_by_id(current_user_id, instrument_id)
+        await db_handler.delete_current_user_instrument_by_id(current_user_id, instrument_id)
     except NotFoundError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
     except AppError as e:
@@ -97,16 +97,35 @@ async def delete_current_user_personal_instrument_by_id(instrument_id: int, db_h
         "messages": f"SUCCESS: personal instrument with id: {instrument_id} deleted."
     }
 
-@instrument_router.post("/me", status_code=status.HTTP_201_CREATED)
-async def create_current_user_instruments(personal_instrument_list: PersonalInstrumentsUpload, db_handler=Depends(get_db_handler), current_user: User=Depends(get_current_user)):
+# Adds instruments to the current user, instruments they already have are skipped. Returns the newly added rows.
+@instrument_router.post("/me", status_code=status.HTTP_201_CREATED, response_model=MessagesResponse[UserPayload[List[PersonalInstrumentOut]]])
+async def create_current_user_instruments(personal_instrument_list: PersonalInstrumentsUpload, db_handler=Depends(get_async_db_handler), current_user: User=Depends(get_current_user)):
     try:
         current_user_id = current_user.id
         personal_instrument_id_list = personal_instrument_list.id
-        result = db_handler.create_personal_instruments(current_user_id, personal_instrument_id_list)
+        result = await db_handler.create_personal_instruments(current_user_id, personal_instrument_id_list)
+    except NotFoundError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     return {
         "data": {"user": current_user.email, "payload": result},
         "messages": f"SUCCESS: created instruments for current user."
+    }
+
+
+# Replaces the current user's instruments with exactly the given set, e.g. when the profile editor is saved
+@instrument_router.put("/me", status_code=status.HTTP_200_OK, response_model=MessagesResponse[UserPayload[PersonalTagSetOut]])
+async def replace_current_user_instruments(personal_instrument_list: PersonalInstrumentsUpload, db_handler=Depends(get_async_db_handler), current_user: User=Depends(get_current_user)):
+    try:
+        result = await db_handler.replace_personal_instruments(current_user.id, personal_instrument_list.id)
+    except NotFoundError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return {
+        "data": {"user": current_user.email, "payload": result},
+        "messages": "SUCCESS: instruments replaced for current user."
     }
\ No newline at end of file
@@ -1,20 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from handlers.handlers import get_db_handler
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from handlers.handlers import get_async_db_handler
 from exception import  AppError, NotFoundError, InvalidParameterError, AlreadyExistsError
-from schemas import PersonalChatMessageCreate, User
+from schemas import PersonalChatMessageCreate, User, MessageResponse, BeforePagedMessageResponse, ChatMessageOut, ChatPageResponse, ConversationOut, ConversationReadOut
 from routers.authentication import get_current_user
+from typing import List, Optional
 
 personal_chat_router = APIRouter(
     prefix="/api/chats",
     tags=['chats']
 )
 
-@personal_chat_router.get("/{user_id}", status_code=status.HTTP_200_OK)
-async def get_all_personal_chat_messages(user_id: int, db_handler=Depends(get_db_handler)):
+# Chat history is returned newest first, one page at a time.
+# Pass the id of the oldest message you have as `before` to load older messages,
+# or the id of the newest message you have as `after` to catch up on newer ones.
+def get_page_cursors(chat_message_list):
+    if not chat_message_list:
+        return {"before": None, "after": None}
+    return {"before": chat_message_list[-1].id, "after": chat_message_list[0].id}
+
+
+@personal_chat_router.get("/{user_id}", status_code=status.HTTP_200_OK, response_model=ChatPageResponse)
+async def get_all_personal_chat_messages(user_id: int, before: Optional[int] = None, after: Optional[int] = None, limit: int = Query(50, ge=1, le=200), db_handler=Depends(get_async_db_handler)):
     try:
-        chat_message_list = db_handler.get_all_personal_chat_message(user_id)
-        if not chat_message_list or len(chat_message_list) == 0:
+        chat_message_list = await db_handler.get_all_personal_chat_message(user_id, before, after, limit)
+        if not before and not after and len(chat_message_list) == 0:
             raise NotFoundError("No chat records exist for the given user.")
+    except InvalidParameterError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
     except NotFoundError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
     except AppError as e:
@@ -22,14 +34,46 @@ async def get_all_personal_chat_messages(user_id: int, db_handler=Depends(get_db
     
     return {
         "data": chat_message_list,
+        "cursor": get_page_cursors(chat_message_list),
         "message": "SUCCESS: user chat record retrieved by id."
     }
 
-@personal_chat_router.get("/me/{correspondent_id}", status_code=status.HTTP_200_OK)
-async def get_current_user_personal_dms(correspondent_id: int, db_handler=Depends(get_db_handler), current_user: User =Depends(get_current_user)):
+# Inbox: one entry per correspondent with the last message and the unread count, most recent first.
+# Pass cursor.before of a page as `before` to load the next one.
+@personal_chat_router.get("/me/conversations", status_code=status.HTTP_200_OK, response_model=BeforePagedMessageResponse[List[ConversationOut]])
+async def get_current_user_conversations(before: Optional[int] = None, limit: int = Query(20, ge=1, le=100), db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
+    try:
+        conversations = await db_handler.get_conversations(current_user.id, before, limit)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return {
+        "data": conversations,
+        "cursor": {"before": conversations[-1]["last_message"]["id"] if len(conversations) == limit else None},
+        "message": "SUCCESS: current user conversations retrieved."
+    }
+
+@personal_chat_router.put("/me/conversations/{correspondent_id}/read", status_code=status.HTTP_200_OK, response_model=MessageResponse[ConversationReadOut])
+async def mark_current_user_conversation_read(correspondent_id: int, db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
+    try:
+        conversation = await db_handler.mark_conversation_read(current_user.id, correspondent_id)
+    except NotFoundError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return {
+        "data": conversation,
+        "message": "SUCCESS: conversation marked as read."
+    }
+
+@personal_chat_router.get("/me/{correspondent_id}", status_code=status.HTTP_200_OK, response_model=ChatPageResponse)
+async def get_current_user_personal_dms(correspondent_id: int, before: Optional[int] = None, after: Optional[int] = None, limit: int = Query(50, ge=1, le=200), db_handler=Depends(get_async_db_handler), current_user: User =Depends(get_current_user)):
     try:
         current_user_id = current_user.id
-        personal_dms = db_handler.get_current_user_dms(current_user_id, correspondent_id)
+        personal_dms = await db_handler.get_current_user_dms(current_user_id, correspondent_id, before, after, limit)
+    except InvalidParameterError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
     except NotFoundError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
     except AppError as e:
@@ -37,15 +81,16 @@ async def get_current_user_personal_dms(correspondent_id: int, db_handler=Depend
     
     return {
         "data": personal_dms,
+        "cursor": get_page_cursors(personal_dms),
         "message": "SUCCESS: current user dms retrieved."
     }
     
 
-@personal_chat_router.post("", status_code=status.HTTP_201_CREATED)
-async def create_personal_chat_message(payload: PersonalChatMessageCreate, db_handler=Depends(get_db_handler)):
+@personal_chat_router.post("", status_code=status.HTTP_201_CREATED, response_model=MessageResponse[ChatMessageOut])
+async def create_personal_chat_message(payload: PersonalChatMessageCreate, db_handler=Depends(get_async_db_handler)):
     try:
         sender_id, receiver_id, content = payload.sender_id, payload.receiver_id, payload.content
-        chat_message = db_handler.create_personal_chat_message(sender_id=sender_id, receiver_id=receiver_id, content=content)
+        chat_message = await db_handler.create_personal_chat_message(sender_id=sender_id, receiver_id=receiver_id, content=content)
     except InvalidParameterError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
     except NotFoundError as e:
@@ -1,8 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from handlers.handlers import get_db_handler
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import ORJSONResponse
+from handlers.handlers import get_async_db_handler
 from exception import  AppError, NotFoundError, InvalidParameterError, AlreadyExistsError
-from schemas import User, UserDetailUpdate, CollaborationPreference, UserDetailCreate
+from schemas import User, UserDetailUpdate, CollaborationPreference, UserDetailCreate, UserLocationUpdate
+from schemas import MessagesResponse, PagedMessagesResponse, AfterPagedMessagesResponse, MessageResponse, UserPayload, UserOut, UserDetailWithFollowsOut, CurrentUserDetailOut, UserGenresOut, UserInstrumentsOut, UserProfileOut, ProfilePictureSize
+from schemas import FollowStateOut, FollowCountsOut, UserSearchResultOut, UserFilterOut, NearbyUserOut, BandmateRecommendationOut, OnlineStatusOut
+from routers import files
+from utils.file_streaming import media_version
 from routers.authentication import get_current_user
+from sockets.presence import presence_registry
+from typing import List, Optional
+import hashlib
 
 
 user_router = APIRouter(
@@ -10,6 +18,12 @@ user_router = APIRouter(
     tags=["users"],
 )
 
+# Columns that PUT /details/me must not write: keys, columns kept in sync by other endpoints (media keys are only
+# set by the upload routes) and generated columns
+protected_detail_fields = {"id", "user_id", "latitude", "longitude", "geohash", "search_vector", "search_text", "profile_picture", "audio_sample"}
+
+profile_response_model = MessagesResponse[UserProfileOut]
+
 collaboration_map = {
     "Online": CollaborationPreference.online,
     "In Person": CollaborationPreference.in_person,
@@ -17,10 +31,10 @@ collaboration_map = {
 }
 
 
-@user_router.get("/all", status_code=status.HTTP_200_OK)
-async def get_all_users(db_handler=Depends(get_db_handler)):
+@user_router.get("/all", status_code=status.HTTP_200_OK, response_model=MessagesResponse[List[UserOut]])
+async def get_all_users(db_handler=Depends(get_async_db_handler)):
     try:
-        user_list = db_handler.get_users()
+        user_list = await db_handler.get_users()
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -29,40 +43,48 @@ async def get_all_users(db_handler=Depends(get_db_handler)):
         "messages": f"SUCCESS: {len(user_list)} users retrieved."
     }
 
-@user_router.get("/all/genres", status_code=status.HTTP_200_OK)
-async def get_all_users_genres(db_handler=Depends(get_db_handler)):
+# Tag lists cover every user unless a page is asked for with limit, e.g. ?skip=0&limit=100. A paged response's
+# cursor.skip is the skip of the next page, null once the last page was returned.
+def get_skip_cursor(page, skip: int, limit: Optional[int]):
+    return {"skip": skip + limit if limit is not None and len(page) == limit else None}
+
+
+@user_router.get("/all/genres", status_code=status.HTTP_200_OK, response_model=PagedMessagesResponse[List[UserGenresOut]])
+async def get_all_users_genres(skip: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1, le=500), db_handler=Depends(get_async_db_handler)):
     try:
-        users_genre_list = db_handler.get_all_users_genres()
+        users_genre_list = await db_handler.get_all_users_genres(skip, limit)
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     return {
         "data": users_genre_list,
+        "cursor": get_skip_cursor(users_genre_list, skip, limit),
         "messages": f"SUCCESS all users genres retrieved."
     }
 
-@user_router.get("/all/instruments", status_code=status.HTTP_200_OK)
-async def get_all_users_instruments(db_handler=Depends(get_db_handler)):
+@user_router.get("/all/instruments", status_code=status.HTTP_200_OK, response_model=PagedMessagesResponse[List[UserInstrumentsOut]])
+async def get_all_users_instruments(skip: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1, le=500), db_handler=Depends(get_async_db_handler)):
     try:
-        users_instruments_list = db_handler.get_all_users_instruments()
+        users_instruments_list = await db_handler.get_all_users_instruments(skip, limit)
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     return {
         "data": users_instruments_list,
+        "cursor": get_skip_cursor(users_instruments_list, skip, limit),
         "messages": f"SUCCESS all users instruments retrieved."
     }
 
     
-@user_router.get("/me")
+@user_router.get("/me", response_model=UserOut)
 async def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
 
 
-@user_router.get("/details/all", status_code=status.HTTP_200_OK)
-async def get_all_user_personal_details(db_handler=Depends(get_db_handler)):
+@user_router.get("/details/all", status_code=status.HTTP_200_OK, response_model=MessageResponse[List[UserDetailWithFollowsOut]])
+async def get_all_user_personal_details(db_handler=Depends(get_async_db_handler)):
     try:
-        db_user_details_list = db_handler.get_all_user_personal_details()
+        db_user_details_list = await db_handler.get_all_user_personal_details()
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -72,11 +94,11 @@ async def get_all_user_personal_details(db_handler=Depends(get_db_handler)):
     }
 
 
-@user_router.get("/details/me", status_code=status.HTTP_200_OK)
-async def get_current_user_personal_details(db_handler=Depends(get_db_handler), current_user: User = Depends(get_current_user)):
+@user_router.get("/details/me", status_code=status.HTTP_200_OK, response_model=MessagesResponse[UserPayload[CurrentUserDetailOut]])
+async def get_current_user_personal_details(db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
     try:
         current_user_id = current_user.id
-        db_current_user_details = db_handler.get_current_user_personal_details(current_user_id)
+        db_current_user_details = await db_handler.get_current_user_personal_details(current_user_id, with_follows=True)
         if not db_current_user_details:
             raise NotFoundError("No personal details found by current user id.")
     except NotFoundError as e:
@@ -90,8 +112,8 @@ async def get_current_user_personal_details(db_handler=Depends(get_db_handler),
     }
 
 
-@user_router.post("/details/me", status_code=status.HTTP_201_CREATED)
-async def create_current_user_personal_details(user_details: UserDetailCreate, db_handler=Depends(get_db_handler), current_user: User = Depends(get_current_user)):
+@user_router.post("/details/me", status_code=status.HTTP_201_CREATED, response_model=MessagesResponse[UserPayload[CurrentUserDetailOut]])
+async def create_current_user_personal_details(user_details: UserDetailCreate, db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
     try:
         current_user_id = current_user.id
         first_name = user_details.first_name
@@ -103,7 +125,7 @@ async def create_current_user_personal_details(user_details: UserDetailCreate, d
         if not preference:
             raise InvalidParameterError("Invalid user preference data.")
         
-        db_user_details = db_handler.create_current_user_personal_details(first_name, last_name, title, description, preference, address, current_user_id)
+        db_user_details = await db_handler.create_current_user_personal_details(first_name, last_name, title, description, preference, address, current_user_id)
     except AlreadyExistsError as e:
          raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
     except AppError as e:
@@ -114,48 +136,229 @@ async def create_current_user_personal_details(user_details: UserDetailCreate, d
         "messages": f"SUCCESS: created personal details for current users."
     }
 
-@user_router.put("/follow", status_code=status.HTTP_200_OK)
-async def follow(other_user_id: int, db_handler=Depends(get_db_handler), current_user: User = Depends(get_current_user)):
+@user_router.put("/follow", status_code=status.HTTP_200_OK, response_model=MessagesResponse[UserPayload[FollowStateOut]])
+async def follow(other_user_id: int, db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
     try:
         current_user_id = current_user.id
-        db_current_user_details = db_handler.follow_user(current_user_id, other_user_id)
-        if not db_current_user_details:
-            raise NotFoundError("No personal details found by current user id.")
+        follow_state = await db_handler.follow_user(current_user_id, other_user_id)
+    except InvalidParameterError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
     except NotFoundError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     return {
-        "data": {"user": current_user.email, "payload": db_current_user_details},
+        "data": {"user": current_user.email, "payload": follow_state},
         "messages": f"SUCCESS: {current_user.email} is now following user with id {other_user_id}."
     }
 
 
-@user_router.put("/unfollow", status_code=status.HTTP_200_OK)
-async def unfollow(other_user_id: int, db_handler=Depends(get_db_handler), current_user: User = Depends(get_current_user)):
+@user_router.put("/unfollow", status_code=status.HTTP_200_OK, response_model=MessagesResponse[UserPayload[FollowStateOut]])
+async def unfollow(other_user_id: int, db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
     try:
         current_user_id = current_user.id
-        db_current_user_details = db_handler.unfollow_user(current_user_id, other_user_id)
-        if not db_current_user_details:
-            raise NotFoundError("No personal details found by current user id.")
-    except NotFoundError as e:
-        raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
+        follow_state = await db_handler.unfollow_user(current_user_id, other_user_id)
     except AppError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     return {
-        "data": {"user": current_user.email, "payload": db_current_user_details},
+        "data": {"user": current_user.email, "payload": follow_state},
         "messages": f"SUCCESS: {current_user.email} unfollowed user with id {other_user_id}."
     }
 
 
-@user_router.put("/details/me", status_code=status.HTTP_200_OK)
-async def update_current_user_personal_details_address(payload: UserDetailUpdate, db_handler=Depends(get_db_handler), current_user: User = Depends(get_current_user)):
+@user_router.get("/{user_id}/followers", status_code=status.HTTP_200_OK, response_model=AfterPagedMessagesResponse[List[int]])
+async def get_followers(user_id: int, after: Optional[int] = None, limit: int = Query(50, ge=1, le=500), db_handler=Depends(get_async_db_handler)):
+    try:
+        follower_ids = await db_handler.get_followers(user_id, after, limit)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return {
+        "data": follower_ids,
+        "cursor": {"after": follower_ids[-1] if follower_ids else None},
+        "messages": f"SUCCESS: {len(follower_ids)} followers retrieved."
+    }
+
+
+@user_router.get("/{user_id}/following", status_code=status.HTTP_200_OK, response_model=AfterPagedMessagesResponse[List[int]])
+async def get_following(user_id: int, after: Optional[int] = None, limit: int = Query(50, ge=1, le=500), db_handler=Depends(get_async_db_handler)):
+    try:
+        following_ids = await db_handler.get_following(user_id, after, limit)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return {
+        "data": following_ids,
+        "cursor": {"after": following_ids[-1] if following_ids else None},
+        "messages": f"SUCCESS: {len(following_ids)} followed users retrieved."
+    }
+
+
+@user_router.get("/{user_id}/follow_counts", status_code=status.HTTP_200_OK, response_model=MessagesResponse[FollowCountsOut])
+async def get_follow_counts(user_id: int, db_handler=Depends(get_async_db_handler)):
+    try:
+        follow_counts = await db_handler.get_follow_counts(user_id)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return {
+        "data": follow_counts,
+        "messages": "SUCCESS: follow counts retrieved."
+    }
+
+
+# Media urls carry the upload's version as v=, so the files routes can let clients cache them for good
+def get_profile_media_urls(user_id: int, details):
+    picture_path = files.router.url_path_for("get_profile_pic_by_id", user_id=str(user_id))
+    version = f"&v={media_version(details.profile_picture)}" if details and details.profile_picture else "" # no upload: the default avatar
+    audio_url = None
+    if details and details.audio_sample:
+        audio_url = f"{files.router.url_path_for('get_audio_file', user_id=str(user_id))}?v={media_version(details.audio_sample)}"
+
+    return {
+        "profile_picture": {size.value: f"{picture_path}?size={size.value}{version}" for size in ProfilePictureSize},
+        "audio_sample": audio_url,
+    }
+
+
+# Everything the profile screen needs (details, genre and instrument names, follow counts, whether the current user
+# follows them and media urls) from a single query. The ETag is a hash of the body, send it back as If-None-Match
+# to get a 304 when nothing changed.
+@user_router.get("/{user_id}/profile", status_code=status.HTTP_200_OK, response_model=profile_response_model)
+async def get_user_profile(user_id: int, request: Request, db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
+    try:
+        profile = await db_handler.get_user_profile(user_id, current_user.id)
+    except NotFoundError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    profile["media"] = get_profile_media_urls(user_id, profile["details"])
+    body = profile_response_model.model_validate({
+        "data": profile,
+        "messages": "SUCCESS: user profile retrieved."
+    }, from_attributes=True)
+
+    response = ORJSONResponse(body.model_dump(mode="json"))
+    etag = f'"{hashlib.sha1(response.body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"} # the body depends on who asks
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    return response
+
+
+# Musician directory search over name, title, description and address, best match first.
+# e.g. /api/users/search?q=jazz guitar&preference=In Person&skip=0&limit=20
+@user_router.get("/search", status_code=status.HTTP_200_OK, response_model=MessagesResponse[List[UserSearchResultOut]])
+async def search_users(q: str = Query(..., min_length=1, max_length=100), preference: Optional[str] = None, skip: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=100), db_handler=Depends(get_async_db_handler)):
+    try:
+        preference_value = None
+        if preference:
+            preference_value = collaboration_map.get(preference, None)
+            if not preference_value:
+                raise InvalidParameterError("Invalid collaboration preference.")
+        results = await db_handler.search_user_details(q, preference_value, skip, limit)
+    except InvalidParameterError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return {
+        "data": results,
+        "messages": "SUCCESS: user search results retrieved."
+    }
+
+
+# Faceted filter, e.g. jazz pianists who play in person: /api/users/filter?genre_ids=4&instrument_ids=2&preference=In Person
+# Ids within a facet are OR'ed, facets are AND'ed. Returns matching user ids in id order (pass cursor.after for the
+# next page), the total and per value facet counts.
+@user_router.get("/filter", status_code=status.HTTP_200_OK, response_model=AfterPagedMessagesResponse[UserFilterOut])
+async def filter_users(genre_ids: List[int] = Query([], max_length=50), instrument_ids: List[int] = Query([], max_length=50), preference: Optional[str] = None, after: Optional[int] = Query(None, ge=0), limit: int = Query(50, ge=1, le=500), db_handler=Depends(get_async_db_handler)):
+    try:
+        preference_value = None
+        if preference:
+            preference_value = collaboration_map.get(preference, None)
+            if not preference_value:
+                raise InvalidParameterError("Invalid collaboration preference.")
+        results = await db_handler.filter_users_by_facets(genre_ids, instrument_ids, preference_value, after, limit)
+    except InvalidParameterError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    user_ids = results["user_ids"]
+    return {
+        "data": results,
+        "cursor": {"after": user_ids[-1] if len(user_ids) == limit else None},
+        "messages": "SUCCESS: filtered users retrieved."
+    }
+
+
+# Musicians within radius_km of the current user's saved location, nearest first, e.g.
+# /api/users/nearby?radius_km=25&preference=In Person. Arbitrary centers are not accepted, otherwise a few
+# queries from different points would locate another user.
+@user_router.get("/nearby", status_code=status.HTTP_200_OK, response_model=MessagesResponse[List[NearbyUserOut]])
+async def get_nearby_users(radius_km: float = Query(25, gt=0, le=500), preference: Optional[str] = None, limit: int = Query(50, ge=1, le=200), db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
+    try:
+        preference_value = None
+        if preference:
+            preference_value = collaboration_map.get(preference, None)
+            if not preference_value:
+                raise InvalidParameterError("Invalid collaboration preference.")
+
+        user_details = await db_handler.get_current_user_personal_details(current_user.id)
+        if not user_details or user_details.latitude is None:
+            raise InvalidParameterError("Current user has no saved location, set one first.")
+
+        nearby_users = await db_handler.get_nearby_users(user_details.latitude, user_details.longitude, radius_km, preference_value, current_user.id, limit)
+    except InvalidParameterError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return {
+        "data": nearby_users,
+        "messages": "SUCCESS: nearby users retrieved."
+    }
+
+
+# Best bandmate matches for the current user, by shared genres and instruments and a compatible collaboration preference
+@user_router.get("/me/recommendations", status_code=status.HTTP_200_OK, response_model=MessagesResponse[List[BandmateRecommendationOut]])
+async def get_current_user_recommendations(limit: int = Query(20, ge=1, le=100), db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
+    try:
+        recommendations = await db_handler.get_bandmate_recommendations(current_user.id, limit)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return {
+        "data": recommendations,
+        "messages": "SUCCESS: bandmate recommendations retrieved."
+    }
+
+
+# Which of the given users have at least one connected socket, e.g. /api/users/online?ids=1&ids=2
+# Served from the presence registry, the database is not touched.
+@user_router.get("/online", status_code=status.HTTP_200_OK, response_model=MessagesResponse[List[OnlineStatusOut]])
+async def get_online_users(ids: List[int] = Query(..., max_length=500)):
+    online_ids = await presence_registry.online(dict.fromkeys(ids))
+
+    return {
+        "data": [{"user_id": user_id, "online": user_id in online_ids} for user_id in dict.fromkeys(ids)],
+        "messages": "SUCCESS: online users retrieved."
+    }
+
+
+@user_router.put("/details/me", status_code=status.HTTP_200_OK, response_model=MessagesResponse[UserPayload[CurrentUserDetailOut]])
+async def update_current_user_personal_details_address(payload: UserDetailUpdate, db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
     try:
         current_user_id = current_user.id
         db_column, db_column_value = payload.field, payload.data
-        if db_column == "id" or db_column == "user_id":
+        if db_column in protected_detail_fields:
             raise InvalidParameterError("Updating action is prohibited for the given attribute.")
         
         if db_column == "preference":
@@ -163,7 +366,7 @@ async def update_current_user_personal_details_address(payload: UserDetailUpdate
             if not db_column_value:
                 raise InvalidParameterError("Invalid request data.")
         
-        response = db_handler.update_current_user_personal_details_fields(db_column, db_column_value, current_user_id)
+        response = await db_handler.update_current_user_personal_details_fields(db_column, db_column_value, current_user_id)
     except InvalidParameterError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_400_BAD_REQUEST)
     except NotFoundError as e:
@@ -177,10 +380,25 @@ async def update_current_user_personal_details_address(payload: UserDetailUpdate
     }
     
 
-@user_router.get("/{user_email}", status_code=status.HTTP_200_OK)
-async def get_user_by_email(user_email: str, db_handler=Depends(get_db_handler), current_user: User = Depends(get_current_user)):
+@user_router.put("/details/me/location", status_code=status.HTTP_200_OK, response_model=MessagesResponse[UserPayload[CurrentUserDetailOut]])
+async def update_current_user_location(payload: UserLocationUpdate, db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
+    try:
+        response = await db_handler.update_current_user_location(current_user.id, payload.latitude, payload.longitude)
+    except NotFoundError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
+    except AppError as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return {
+        "data": {"user": current_user.email, "payload": response},
+        "messages": "SUCCESS: update current user location."
+    }
+
+
+@user_router.get("/{user_email}", status_code=status.HTTP_200_OK, response_model=MessageResponse[UserOut])
+async def get_user_by_email(user_email: str, db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
     try:
-        user = db_handler.get_user_by_email(user_email)
+        user = await db_handler.get_user_by_email(user_email)
         if not user:
             raise NotFoundError("User email does not exist.")
     except NotFoundError as e:
@@ -192,10 +410,10 @@ async def get_user_by_email(user_email: str, db_handler=Depends(get_db_handler),
     }
 
 
-@user_router.delete("/{user_email}", status_code=status.HTTP_200_OK)
-async def delete_user_by_email(user_email: str, db_handler=Depends(get_db_handler), current_user: User = Depends(get_current_user)):
+@user_router.delete("/{user_email}", status_code=status.HTTP_200_OK, response_model=MessageResponse[str])
+async def delete_user_by_email(user_email: str, db_handler=Depends(get_async_db_handler), current_user: User = Depends(get_current_user)):
     try:
-        db_handler.delete_user_by_email(user_email)
+        await db_handler.delete_user_by_email(user_email)
     except NotFoundError as e:
         raise HTTPException(detail=str(e), status_code=status.HTTP_404_NOT_FOUND)
     
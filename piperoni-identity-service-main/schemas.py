@@ -1,5 +1,6 @@
-from typing import List, Union
-from pydantic import BaseModel
+from typing import Dict, Generic, List, Optional, TypeVar, Union
+from datetime import datetime
+from pydantic import BaseModel, Field
 import enum
 
 # Pydantic models defined here
@@ -35,6 +36,12 @@ class CollaborationPreference(enum.Enum):
     no_preference = "No Preference"
 
 
+class ProfilePictureSize(str, enum.Enum):
+    thumbnail = "thumbnail"
+    card = "card"
+    full = "full"
+
+
 class UserDetailUpdate(BaseModel):
     field: str # the column of the table you want to update
     data: str # new value of the column
@@ -46,8 +53,11 @@ class UserDetailCreate(BaseModel):
     description: str
     preference: str
     address: str
-    followers: List[int]
-    following: List[int]
+
+
+class UserLocationUpdate(BaseModel): # supplied by the client, e.g. from the phone's location service
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
 
 
 class PersonalGenresUpload(BaseModel):
@@ -62,4 +72,212 @@ class GoogleSignInAccount(BaseModel): # Defined in Flutter google_sign_in packag
 class PersonalChatMessageCreate(BaseModel):
     sender_id: int
     receiver_id: int
-    content: str
\ No newline at end of file
+    content: str
+
+
+# Response models. Routes declare these as their response_model, so FastAPI validates the returned ORM rows
+# straight into them with pydantic-core and serializes only the declared fields, instead of reflecting over
+# every instance with jsonable_encoder (which also leaked columns such as users.hashed_password).
+
+DataT = TypeVar("DataT")
+
+class MessagesResponse(BaseModel, Generic[DataT]): # {"data": ..., "messages": ...}
+    data: DataT
+    messages: str
+
+class MessageResponse(BaseModel, Generic[DataT]): # {"data": ..., "message": ...}
+    data: DataT
+    message: str
+
+class SkipPageCursor(BaseModel):
+    skip: Optional[int] # pass as skip to get the next page, null on the last one
+
+class PagedMessagesResponse(MessagesResponse[DataT], Generic[DataT]): # {"data": ..., "cursor": ..., "messages": ...}
+    cursor: SkipPageCursor
+
+class AfterPageCursor(BaseModel):
+    after: Optional[int] # pass as after to get the next page, null on the last one
+
+class AfterPagedMessagesResponse(MessagesResponse[DataT], Generic[DataT]): # {"data": ..., "cursor": {"after": ...}, "messages": ...}
+    cursor: AfterPageCursor
+
+class BeforePageCursor(BaseModel):
+    before: Optional[int] # pass as before to get the next page, null on the last one
+
+class BeforePagedMessageResponse(MessageResponse[DataT], Generic[DataT]): # {"data": ..., "cursor": {"before": ...}, "message": ...}
+    cursor: BeforePageCursor
+
+class UserPayload(BaseModel, Generic[DataT]): # current user endpoints wrap their data as {"user": email, "payload": ...}
+    user: str
+    payload: DataT
+
+class UserOut(BaseModel):
+    id: int
+    email: str
+    oauth2: bool
+
+    class Config:
+        from_attributes = True
+
+class CatalogItemOut(BaseModel): # a genre or an instrument
+    id: int
+    name: str
+
+    class Config:
+        from_attributes = True
+
+class SelectableCatalogItemOut(CatalogItemOut):
+    selected: bool
+
+class PersonalGenreOut(BaseModel):
+    id: int
+    user_id: int
+    genre_id: int
+
+    class Config:
+        from_attributes = True
+
+class PersonalInstrumentOut(BaseModel):
+    id: int
+    user_id: int
+    instrument_id: int
+
+    class Config:
+        from_attributes = True
+
+class PersonalTagSetOut(BaseModel): # result of replacing a user's genres / instruments
+    ids: List[int]
+    added: List[int]
+    removed: List[int]
+
+class UserGenresOut(BaseModel):
+    user_id: int
+    genres: List[str]
+
+class UserInstrumentsOut(BaseModel):
+    user_id: int
+    instruments: List[str]
+
+class UserDetailOut(BaseModel): # public profile fields, the location is only returned to its owner
+    id: int
+    user_id: int
+    first_name: Optional[str]
+    last_name: Optional[str]
+    title: Optional[str]
+    description: Optional[str]
+    preference: CollaborationPreference
+    address: Optional[str]
+    profile_picture: Optional[str]
+    audio_sample: Optional[str]
+
+    class Config:
+        from_attributes = True
+
+class UserDetailWithFollowsOut(UserDetailOut):
+    followers: List[int] # user ids
+    following: List[int]
+
+class CurrentUserDetailOut(UserDetailWithFollowsOut):
+    latitude: Optional[float]
+    longitude: Optional[float]
+
+class ProfilePictureUrlsOut(BaseModel):
+    thumbnail: str
+    card: str
+    full: str
+
+class ProfileMediaOut(BaseModel):
+    profile_picture: ProfilePictureUrlsOut
+    audio_sample: Optional[str]
+
+class FollowCountsOut(BaseModel):
+    followers: int
+    following: int
+
+class FollowStateOut(BaseModel):
+    follower_id: int
+    followee_id: int
+    following: bool
+
+class UserSearchResultOut(BaseModel):
+    user_id: int
+    first_name: Optional[str]
+    last_name: Optional[str]
+    title: Optional[str]
+    description: Optional[str]
+    preference: CollaborationPreference
+    address: Optional[str]
+    rank: float
+
+class FacetCountsOut(BaseModel): # value -> number of matching users, genres and instruments keyed by id
+    genres: Dict[int, int]
+    instruments: Dict[int, int]
+    preferences: Dict[str, int]
+
+class UserFilterOut(BaseModel):
+    user_ids: List[int]
+    total: int
+    facets: FacetCountsOut
+
+class NearbyUserOut(BaseModel):
+    user_id: int
+    first_name: Optional[str]
+    last_name: Optional[str]
+    title: Optional[str]
+    preference: CollaborationPreference
+    distance_km: int # rounded up to whole NEARBY_DISTANCE_STEP_KM
+
+class BandmateRecommendationOut(BaseModel):
+    user_id: int
+    score: float
+    shared_genres: int
+    shared_instruments: int
+    compatible_preference: bool
+
+class OnlineStatusOut(BaseModel):
+    user_id: int
+    online: bool
+
+class UserProfileOut(BaseModel):
+    user_id: int
+    details: Optional[UserDetailOut]
+    genres: List[str]
+    instruments: List[str]
+    follow_counts: FollowCountsOut
+    following: bool # whether the current user follows this user
+    media: ProfileMediaOut
+
+class ChatMessageOut(BaseModel):
+    id: int
+    timestamp: datetime
+    content: str
+    sender_id: int
+    receiver_id: int
+
+    class Config:
+        from_attributes = True
+
+class ConversationMessageOut(BaseModel):
+    id: int
+    content: str
+    sender_id: int
+    timestamp: datetime
+
+class ConversationOut(BaseModel):
+    correspondent_id: int
+    correspondent_email: str
+    last_message: ConversationMessageOut
+    unread_count: int
+
+class ConversationReadOut(BaseModel):
+    correspondent_id: int
+    unread_count: int
+
+class ChatPageCursor(BaseModel):
+    before: Optional[int]
+    after: Optional[int]
+
+class ChatPageResponse(BaseModel):
+    data: List[ChatMessageOut]
+    cursor: ChatPageCursor
+    message: str
@@ -0,0 +1,36 @@
+from time import time
+from db_config import settings
+
+
+# In-memory copy of the small, rarely changing catalogs (genres, instruments).
+# Admin writes bump the version, which drops the cached rows; a load that started before a bump
+# is not stored, so a stale read can never overwrite a fresher invalidation.
+# The ttl bounds how long another worker's write can go unnoticed by this one.
+class CatalogCache:
+    def __init__(self, ttl: float) -> None:
+        super().__init__()
+        self.ttl = ttl
+        self.version = 0
+        self._catalogs = {} # catalog name -> (loaded_at, rows)
+
+    async def get(self, name: str, loader):
+        cached = self._catalogs.get(name)
+        if cached and cached[0] + self.ttl > time():
+            return cached[1]
+
+        version = self.version
+        rows = await loader()
+        if version == self.version:
+            self._catalogs[name] = (time(), rows)
+
+        return rows
+
+    def invalidate(self, name: str = None):
+        self.version += 1
+        if name:
+            self._catalogs.pop(name, None)
+        else:
+            self._catalogs.clear()
+
+
+catalog_cache = CatalogCache(ttl=settings.CATALOG_CACHE_TTL)
@@ -3,51 +3,30 @@ class CurrentUserService:
         super().__init__()
         self.db_handler = db_handler
     
-    def fetch_current_user_personal_genres(self, user_id: int):
-        all_genres = self.db_handler.get_all_music_genres()
-        personal_genres = self.db_handler.get_current_user_genres(user_id)
+    # The full catalog comes from the in-memory catalog cache, so the only query here
+    # is the indexed lookup of the user's own tag ids.
+    async def fetch_current_user_personal_genres(self, user_id: int):
+        all_genres = await self.db_handler.get_all_music_genres()
+        selected_genres = await self.db_handler.get_current_user_genre_ids(user_id)
 
         result = []
-        selected_genres = set()
-
-        for personal_genre in personal_genres:
-            selected_genres.add(personal_genre.name)
-        
-        for genres in all_genres:
-            genres_dict = genres.__dict__
-            is_selected = False
-
-            if genres.name in selected_genres:
-                is_selected = True
-        
+        for genre in all_genres:
             result.append({
-                **genres_dict,
-                "selected": is_selected
+                **genre,
+                "selected": genre["id"] in selected_genres
             })
 
         return result
     
-    def fetch_current_user_personal_instruments(self, user_id: int):
-        all_instruments = self.db_handler.get_all_instruments()
-        personal_instruments = self.db_handler.get_current_user_instruments(user_id)
+    async def fetch_current_user_personal_instruments(self, user_id: int):
+        all_instruments = await self.db_handler.get_all_instruments()
+        selected_instruments = await self.db_handler.get_current_user_instrument_ids(user_id)
 
         result = []
-        selected_instruments = set()
-
-        for personal_instrument in personal_instruments:
-            selected_instruments.add(personal_instrument.name)
-
         for instrument in all_instruments:
-            instrument_dict = instrument.__dict__
-            is_selected = False
-
-            if instrument.name in selected_instruments:
-                is_selected = True
-            
             result.append({
-                **instrument_dict,
-                "selected": is_selected
+                **instrument,
+                "selected": instrument["id"] in selected_instruments
             })
 
-        return result
-    
\ No newline at end of file
+        return result
\ No newline at end of file
@@ -0,0 +1,138 @@
+from db_config import settings
+from services.tag_index import TagIndex
+
+FACETS = ("genres", "instruments", "preferences")
+
+
+def popcount(bits: int) -> int:
+    return bits.bit_count() if hasattr(bits, "bit_count") else bin(bits).count("1") # int.bit_count() is python 3.10+
+
+
+def bitmap_from_ids(ids) -> int:
+    # Building through a bytearray is linear, OR-ing one bit at a time into a big int would be quadratic
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for user_id in ids:
+        buffer[user_id >> 3] |= 1 << (user_id & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def empty_state() -> dict:
+    return {
+        "bitmaps": {facet: {} for facet in FACETS}, # facet -> value -> bitmap
+        "user_preferences": {}, # user id -> preference, to clear the old bit on change
+        "all_users": 0,
+    }
+
+
+def first_bits(bits: int, start: int, limit: int):
+    # Up to limit set bit positions >= start in ascending order. The bitmap is turned into a string once
+    # and scanned, instead of one big-int operation per result.
+    digits = bin(bits)[:1:-1] # least significant bit first
+    positions = []
+    position = digits.find("1", start)
+    while position != -1 and len(positions) < limit:
+        positions.append(position)
+        position = digits.find("1", position + 1)
+    return positions
+
+
+# Faceted musician filter ("jazz pianists who play in person") answered from memory.
+# Every genre, instrument and preference value has a bitmap of user ids, stored as a python int with bit
+# user_id set, so filters are a handful of big-int OR / AND operations over a few KB each, independent of
+# how many rows the tables have. Values in one facet are OR'ed, facets are AND'ed.
+# Loading, refreshing and building off the event loop are handled by TagIndex.
+class FacetIndex(TagIndex):
+    def __init__(self, refresh_seconds: float) -> None:
+        super().__init__(refresh_seconds)
+        vars(self).update(empty_state())
+
+    def _set(self, facet: str, value, user_id: int, present: bool):
+        bitmaps = self.bitmaps[facet]
+        if present:
+            bitmaps[value] = bitmaps.get(value, 0) | (1 << user_id)
+            self.all_users |= 1 << user_id
+        elif value in bitmaps:
+            bitmaps[value] &= ~(1 << user_id)
+
+    def _set_preference(self, user_id: int, preference):
+        old = self.user_preferences.get(user_id)
+        if old is not None:
+            self._set("preferences", old, user_id, False)
+        self.user_preferences[user_id] = preference
+        self._set("preferences", preference, user_id, True)
+
+    def _build(self, genre_rows, instrument_rows, preference_rows) -> dict:
+        state = empty_state()
+        state["user_preferences"] = dict(preference_rows)
+        for facet, rows in (("genres", genre_rows), ("instruments", instrument_rows), ("preferences", preference_rows)):
+            ids_by_value = {}
+            for user_id, value in rows:
+                ids_by_value.setdefault(value, []).append(user_id)
+            state["bitmaps"][facet] = {value: bitmap_from_ids(ids) for value, ids in ids_by_value.items()}
+        state["all_users"] = bitmap_from_ids(user_id for rows in (genre_rows, instrument_rows, preference_rows) for user_id, _ in rows)
+        return state
+
+    # Incremental updates, called after the matching database write has been committed
+    def add_tags(self, kind: str, user_id: int, tag_ids):
+        self.version += 1
+        if self.loaded_at is not None:
+            for tag_id in tag_ids:
+                self._set(kind, tag_id, user_id, True)
+
+    def remove_tags(self, kind: str, user_id: int, tag_ids):
+        self.version += 1
+        if self.loaded_at is not None:
+            for tag_id in tag_ids:
+                self._set(kind, tag_id, user_id, False)
+
+    def set_preference(self, user_id: int, preference):
+        self.version += 1
+        if self.loaded_at is not None:
+            self._set_preference(user_id, preference)
+
+    def remove_user(self, user_id: int):
+        self.version += 1
+        if self.loaded_at is not None:
+            mask = ~(1 << user_id)
+            for bitmaps in self.bitmaps.values():
+                for value in bitmaps:
+                    bitmaps[value] &= mask
+            self.all_users &= mask
+            self.user_preferences.pop(user_id, None)
+
+    def _facet_filter(self, facet: str, values):
+        if not values:
+            return self.all_users
+        bitmaps = self.bitmaps[facet]
+        bits = 0
+        for value in values:
+            bits |= bitmaps.get(value, 0)
+        return bits
+
+    # Returns up to limit matching user ids above `after` (ascending), the total number of matches and,
+    # for every facet value, how many users would match if that value were added to its facet: each facet's
+    # counts apply the other facets' filters but not its own.
+    def filter(self, selected: dict, after: int = None, limit: int = 50):
+        filters = {facet: self._facet_filter(facet, selected.get(facet)) for facet in FACETS}
+
+        matches = self.all_users
+        for bits in filters.values():
+            matches &= bits
+
+        facet_counts = {}
+        for facet in FACETS:
+            others = self.all_users
+            for other, bits in filters.items():
+                if other != facet:
+                    others &= bits
+            facet_counts[facet] = {value: popcount(bitmap & others) for value, bitmap in self.bitmaps[facet].items() if bitmap & others}
+
+        user_ids = first_bits(matches, after + 1 if after is not None else 0, limit)
+
+        return user_ids, popcount(matches), facet_counts
+
+
+facet_index = FacetIndex(refresh_seconds=settings.FACET_INDEX_REFRESH_SECONDS)
@@ -0,0 +1,175 @@
+import numpy as np
+from schemas import CollaborationPreference
+from db_config import settings
+from services.tag_index import TagIndex
+
+# How much one shared genre / one shared instrument / a compatible collaboration preference is worth
+GENRE_WEIGHT = 1.0
+INSTRUMENT_WEIGHT = 1.5
+PREFERENCE_WEIGHT = 0.5
+
+PREFERENCE_CODES = {preference: code for code, preference in enumerate(CollaborationPreference)}
+NO_PREFERENCE = PREFERENCE_CODES[CollaborationPreference.no_preference]
+
+
+def empty_state(capacity: int = 1024) -> dict:
+    return {
+        "user_rows": {}, # user id -> row
+        "row_users": np.full(capacity, -1, dtype=np.int64),
+        "free_rows": [],
+        "size": 0,
+        "tag_columns": {"genres": {}, "instruments": {}}, # tag id -> column
+        "matrices": {"genres": np.zeros((capacity, 8), dtype=np.float32), "instruments": np.zeros((capacity, 8), dtype=np.float32)},
+        "preferences": np.full(capacity, NO_PREFERENCE, dtype=np.int8),
+    }
+
+
+# Ranks bandmates by how many genres and instruments they share with a user, plus a bonus when their
+# collaboration preferences are compatible. Every user is one row of two dense user x tag matrices
+# (float32 0/1), so scoring everyone against one user is two matrix-vector products and a top-k
+# partition, a few milliseconds at 100k users.
+# Loading, refreshing and building off the event loop are handled by TagIndex.
+class BandmateRecommender(TagIndex):
+    def __init__(self, refresh_seconds: float) -> None:
+        super().__init__(refresh_seconds)
+        vars(self).update(empty_state())
+
+    def _row_for(self, user_id: int) -> int:
+        row = self.user_rows.get(user_id)
+        if row is not None:
+            return row
+
+        if self.free_rows:
+            row = self.free_rows.pop()
+        else:
+            row = self.size
+            self.size += 1
+            if row >= len(self.row_users): # grow by doubling, amortized O(1) per new user
+                capacity = len(self.row_users) * 2
+                self.row_users = np.concatenate([self.row_users, np.full(capacity - len(self.row_users), -1, dtype=np.int64)])
+                self.preferences = np.concatenate([self.preferences, np.full(capacity - len(self.preferences), NO_PREFERENCE, dtype=np.int8)])
+                for kind, matrix in self.matrices.items():
+                    grown = np.zeros((capacity, matrix.shape[1]), dtype=np.float32)
+                    grown[:len(matrix)] = matrix
+                    self.matrices[kind] = grown
+
+        self.user_rows[user_id] = row
+        self.row_users[row] = user_id
+        return row
+
+    def _column_for(self, kind: str, tag_id: int) -> int:
+        columns = self.tag_columns[kind]
+        column = columns.get(tag_id)
+        if column is not None:
+            return column
+
+        column = len(columns)
+        columns[tag_id] = column
+        matrix = self.matrices[kind]
+        if column >= matrix.shape[1]:
+            grown = np.zeros((matrix.shape[0], matrix.shape[1] * 2), dtype=np.float32)
+            grown[:, :matrix.shape[1]] = matrix
+            self.matrices[kind] = grown
+        return column
+
+    def _set_tags(self, kind: str, user_id: int, tag_ids, value: float):
+        row = self._row_for(user_id)
+        for tag_id in tag_ids:
+            column = self._column_for(kind, tag_id) # may grow (replace) the matrix, so look it up afterwards
+            self.matrices[kind][row, column] = value
+
+    def _set_preference(self, user_id: int, preference):
+        self.preferences[self._row_for(user_id)] = PREFERENCE_CODES.get(preference, NO_PREFERENCE)
+
+    def _build(self, genre_rows, instrument_rows, preference_rows) -> dict:
+        tag_rows = {"genres": np.array(genre_rows, dtype=np.int64).reshape(-1, 2), "instruments": np.array(instrument_rows, dtype=np.int64).reshape(-1, 2)}
+        preference_users = np.array([user_id for user_id, _ in preference_rows], dtype=np.int64)
+        users = np.unique(np.concatenate([tag_rows["genres"][:, 0], tag_rows["instruments"][:, 0], preference_users]))
+
+        capacity = 1024
+        while capacity < len(users):
+            capacity *= 2
+        state = empty_state(capacity)
+        state["size"] = len(users)
+        state["row_users"][:len(users)] = users
+        state["user_rows"] = {int(user_id): row for row, user_id in enumerate(users)}
+
+        # every (user, tag) pair becomes a 1 in one vectorized scatter
+        for kind, pairs in tag_rows.items():
+            tags = np.unique(pairs[:, 1])
+            state["tag_columns"][kind] = {int(tag_id): column for column, tag_id in enumerate(tags)}
+            width = 8
+            while width < len(tags):
+                width *= 2
+            matrix = np.zeros((capacity, width), dtype=np.float32)
+            matrix[np.searchsorted(users, pairs[:, 0]), np.searchsorted(tags, pairs[:, 1])] = 1.0
+            state["matrices"][kind] = matrix
+
+        codes = np.array([PREFERENCE_CODES.get(preference, NO_PREFERENCE) for _, preference in preference_rows], dtype=np.int8)
+        state["preferences"][np.searchsorted(users, preference_users)] = codes
+        return state
+
+    # Incremental updates, called after the matching database write has been committed.
+    # Before the first load there is nothing to update, the load will read the write from the database.
+    def add_tags(self, kind: str, user_id: int, tag_ids):
+        self.version += 1
+        if self.loaded_at is not None:
+            self._set_tags(kind, user_id, tag_ids, 1.0)
+
+    def remove_tags(self, kind: str, user_id: int, tag_ids):
+        self.version += 1
+        if self.loaded_at is not None and user_id in self.user_rows:
+            self._set_tags(kind, user_id, [tag_id for tag_id in tag_ids if tag_id in self.tag_columns[kind]], 0.0)
+
+    def set_preference(self, user_id: int, preference):
+        self.version += 1
+        if self.loaded_at is not None:
+            self._set_preference(user_id, preference)
+
+    def remove_user(self, user_id: int):
+        self.version += 1
+        row = self.user_rows.pop(user_id, None) if self.loaded_at is not None else None
+        if row is not None:
+            self.row_users[row] = -1
+            self.preferences[row] = NO_PREFERENCE
+            for matrix in self.matrices.values():
+                matrix[row] = 0
+            self.free_rows.append(row)
+
+    # Top k users sharing at least one genre or instrument with user_id, best first
+    def recommend(self, user_id: int, k: int):
+        row = self.user_rows.get(user_id)
+        if row is None:
+            return []
+
+        size = self.size
+        genres = self.matrices["genres"][:size]
+        instruments = self.matrices["instruments"][:size]
+        shared_genres = genres @ genres[row]
+        shared_instruments = instruments @ instruments[row]
+
+        preferences = self.preferences[:size]
+        own_preference = preferences[row]
+        compatible = (preferences == own_preference) | (preferences == NO_PREFERENCE) | (own_preference == NO_PREFERENCE)
+
+        scores = GENRE_WEIGHT * shared_genres + INSTRUMENT_WEIGHT * shared_instruments + PREFERENCE_WEIGHT * compatible
+        scores[(shared_genres + shared_instruments) == 0] = -1 # nothing in common
+        scores[self.row_users[:size] < 0] = -1 # free rows
+        scores[row] = -1
+
+        k = min(k, size)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        return [{
+            "user_id": int(self.row_users[r]),
+            "score": round(float(scores[r]), 2),
+            "shared_genres": int(shared_genres[r]),
+            "shared_instruments": int(shared_instruments[r]),
+            "compatible_preference": bool(compatible[r]),
+        } for r in top if scores[r] >= 0]
+
+
+bandmate_recommender = BandmateRecommender(refresh_seconds=settings.RECOMMENDER_REFRESH_SECONDS)
@@ -0,0 +1,50 @@
+import asyncio
+from abc import ABC, abstractmethod
+from time import time
+import anyio
+
+
+# Base of the in-memory indexes over personal genres / instruments and preferences (bandmate recommender,
+# facet index). An index is built from the database on first use, patched by the AsyncDBHandler writes on
+# this worker and rebuilt every refresh_seconds to pick up other workers' writes.
+# The build is CPU bound (up to a second at 100k users), so it runs on a worker thread and only the finished
+# state is swapped in on the event loop; requests keep being served from the previous state meanwhile.
+class TagIndex(ABC):
+    def __init__(self, refresh_seconds: float) -> None:
+        super().__init__()
+        self.refresh_seconds = refresh_seconds
+        self.loaded_at = None
+        self.version = 0 # bumped by every write, a load that raced a write is not trusted
+        self._lock = None # created on first use, inside the running event loop
+
+    # Returns the new index state as {attribute: value} from plain (user id, tag id) / (user id, preference)
+    # rows. Runs on a worker thread, so it must not read or change self.
+    @abstractmethod
+    def _build(self, genre_rows, instrument_rows, preference_rows) -> dict:
+        raise NotImplementedError
+
+    def is_fresh(self) -> bool:
+        return bool(self.loaded_at) and self.loaded_at + self.refresh_seconds > time()
+
+    # loader is an async callable returning (genre rows, instrument rows, preference rows), see
+    # AsyncDBHandler.load_user_tag_rows. A write that lands while loading or building leaves the index expired
+    # so the next call rebuilds it, a stale load can never hide a newer write for longer than one call.
+    async def ensure_loaded(self, loader):
+        if self.is_fresh():
+            return
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.is_fresh():
+                return
+
+            version = self.version
+            genre_rows, instrument_rows, preference_rows = await loader()
+            state = await anyio.to_thread.run_sync(self._build, genre_rows, instrument_rows, preference_rows)
+            vars(self).update(state)
+            self.loaded_at = time() if version == self.version else 0
+
+    def invalidate(self):
+        self.version += 1
+        self.loaded_at = 0 if self.loaded_at is not None else None
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+import socketio
+from db_config import settings
+
+logger = logging.getLogger(__name__)
+
+# Tracks which socket ids (one per device) every connected user has, across all workers and containers.
+# Both directions are kept (user -> set of sids, sid -> user) so connect, disconnect and online checks
+# are O(1) per user instead of a scan over everyone connected.
+class PresenceRegistry(ABC):
+    @abstractmethod
+    async def register(self, user_id: int, sid: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def unregister(self, sid: str):
+        # Returns the user id the sid belonged to, or None
+        raise NotImplementedError
+
+    @abstractmethod
+    async def sids(self, user_id: int):
+        # Returns the set of sids of the user, empty when they are offline
+        raise NotImplementedError
+
+    @abstractmethod
+    async def online(self, user_ids):
+        # Returns the subset of user_ids with at least one connected device
+        raise NotImplementedError
+
+    @abstractmethod
+    async def clear(self):
+        raise NotImplementedError
+
+
+# Single process only, used when no REDIS_URL is configured
+class InMemoryPresenceRegistry(PresenceRegistry):
+    def __init__(self) -> None:
+        super().__init__()
+        self.user_sids = {}
+        self.sid_users = {}
+
+    async def register(self, user_id: int, sid: str):
+        self.user_sids.setdefault(user_id, set()).add(sid)
+        self.sid_users[sid] = user_id
+
+    async def unregister(self, sid: str):
+        user_id = self.sid_users.pop(sid, None)
+        if user_id is None:
+            return None
+
+        sids = self.user_sids.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids: # last device gone, the user is offline
+                del self.user_sids[user_id]
+        return user_id
+
+    async def sids(self, user_id: int):
+        return set(self.user_sids.get(user_id, ()))
+
+    async def online(self, user_ids):
+        return {user_id for user_id in user_ids if user_id in self.user_sids}
+
+    async def clear(self):
+        self.user_sids.clear()
+        self.sid_users.clear()
+
+
+# Shared between workers: one redis sorted set per user of sid -> lease expiry (epoch seconds). A worker
+# keeps its own sids in memory and renews their leases every ttl / 3 seconds, so when a worker dies
+# without running its disconnect handlers its sids stop counting as online after at most ttl seconds, and
+# the user key expires once no live worker renews it. Leases use each worker's clock, so the ttl should be
+# well above any clock skew between hosts. Takes any redis.asyncio compatible client, so tests can pass
+# fakeredis.aioredis.FakeRedis().
+class RedisPresenceRegistry(PresenceRegistry):
+    def __init__(self, client, prefix: str = "presence", ttl_seconds: float = 60) -> None:
+        super().__init__()
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.local_sids = {} # sid -> user id, the sockets connected to this worker
+        self._heartbeat = None # started on first register, inside the running event loop
+
+    def user_key(self, user_id) -> str:
+        return f"{self.prefix}:user:{user_id}" # sorted set of sid -> lease expiry
+
+    def _renew(self, pipe, user_id: int, sids):
+        key = self.user_key(user_id)
+        pipe.zadd(key, {sid: time.time() + self.ttl_seconds for sid in sids})
+        pipe.zremrangebyscore(key, "-inf", time.time()) # leases of dead workers
+        pipe.expire(key, int(self.ttl_seconds) + 1)
+
+    async def _renew_leases(self):
+        while True:
+            await asyncio.sleep(self.ttl_seconds / 3)
+            user_sids = {}
+            for sid, user_id in list(self.local_sids.items()):
+                user_sids.setdefault(user_id, []).append(sid)
+            if not user_sids:
+                continue
+            try:
+                async with self.client.pipeline(transaction=False) as pipe:
+                    for user_id, sids in user_sids.items():
+                        self._renew(pipe, user_id, sids)
+                    await pipe.execute()
+            except Exception as e: # redis briefly unreachable, try again on the next beat
+                logger.warning(f"Could not renew presence leases: {e}")
+
+    async def register(self, user_id: int, sid: str):
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._renew_leases())
+        self.local_sids[sid] = user_id
+        async with self.client.pipeline(transaction=True) as pipe:
+            self._renew(pipe, user_id, [sid])
+            await pipe.execute()
+
+    async def unregister(self, sid: str):
+        user_id = self.local_sids.pop(sid, None)
+        if user_id is None:
+            return None
+
+        await self.client.zrem(self.user_key(user_id), sid) # redis drops the set with its last member
+        return user_id
+
+    async def sids(self, user_id: int):
+        live = await self.client.zrangebyscore(self.user_key(user_id), time.time(), "+inf")
+        return {sid.decode() if isinstance(sid, bytes) else sid for sid in live}
+
+    async def online(self, user_ids):
+        user_ids = list(user_ids)
+        now = time.time()
+        async with self.client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zcount(self.user_key(user_id), now, "+inf")
+            found = await pipe.execute()
+        return {user_id for user_id, count in zip(user_ids, found) if count}
+
+    async def clear(self):
+        self.local_sids.clear()
+        keys = [key async for key in self.client.scan_iter(match=f"{self.prefix}:*")]
+        if keys:
+            await self.client.delete(*keys)
+
+
+# With REDIS_URL set, presence lives in redis and Socket.IO emits are published over redis pub/sub so
+# every worker delivers to the sockets it owns. Needs the redis package: pip install redis
+def create_presence_registry() -> PresenceRegistry:
+    if settings.REDIS_URL:
+        import redis.asyncio
+
+        return RedisPresenceRegistry(redis.asyncio.from_url(settings.REDIS_URL), ttl_seconds=settings.PRESENCE_TTL_SECONDS)
+    return InMemoryPresenceRegistry()
+
+
+def create_client_manager():
+    if settings.REDIS_URL:
+        return socketio.AsyncRedisManager(settings.REDIS_URL, channel=settings.SOCKETIO_CHANNEL)
+    return None # socketio falls back to its in-process manager
+
+
+presence_registry = create_presence_registry()
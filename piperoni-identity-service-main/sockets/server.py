@@ -1,8 +1,13 @@
+import time
+from functools import partial
 import socketio
 from auth.auth_token import SECRET_KEY, ALGORITHM
 from jose import jwt, JWTError
-from database import SessionLocal
-from handlers.db_handler import DBHandler
+from database import AsyncSessionLocal
+from handlers.async_db_handler import AsyncDBHandler
+from auth.principal_cache import principal_cache, known_user_ids
+from sockets.presence import presence_registry, create_client_manager
+from db_config import settings
 import logging
 
 # Creating an object
@@ -13,7 +18,8 @@ logger.setLevel(logging.INFO)
 
 sio_server = socketio.AsyncServer(
     async_mode = 'asgi',
-    cors_allowed_origins = ["*"]
+    cors_allowed_origins = ["*"],
+    client_manager = create_client_manager()
 )
 
 
@@ -22,88 +28,167 @@ sio_app = socketio.ASGIApp(
     socketio_path='sockets.io'
 )
 
-current_users = {} # hashmap that tracks of user id and their corresponding socket id
-
-def validate_client_credential(token):
+# Returns the user and the token expiry (epoch seconds). Resolved users are shared with the HTTP auth
+# dependency through principal_cache, so reconnects usually skip the users table.
+async def validate_client_credential(token):
     try:
-        with SessionLocal() as db_session:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_email = payload.get("sub")
-            if not user_email:
-                raise ConnectionRefusedError("Invalid Authentication provided from client.")
-            
-            db_handler = DBHandler(db_session)
-            user = db_handler.get_user_by_email(user_email)
-            if not user:
-                raise ConnectionRefusedError("Invalid Authentication provided from client.")
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         raise ConnectionRefusedError("Error occurred during token validation process.")
-    finally:
-        db_session.close()
 
-    return user
-    
+    user_email = payload.get("sub")
+    if not user_email:
+        raise ConnectionRefusedError("Invalid Authentication provided from client.")
+
+    user_email = user_email.strip()
+    user = principal_cache.get(user_email)
+    if not user:
+        async with AsyncSessionLocal() as db_session:
+            db_handler = AsyncDBHandler(db_session)
+            user = await db_handler.get_user_by_email(user_email)
+        if not user:
+            raise ConnectionRefusedError("Invalid Authentication provided from client.")
+        principal_cache.set(user_email, user, expires_at=payload.get("exp"))
+
+    return user, payload.get("exp")
+
+
+# The identity checked at connect is kept in the socket session, events only look at it again once the
+# token has expired. A client with a long lived connection sends a fresh token as auth_token after that.
+async def get_client_identity(sid, data):
+    session = await sio_server.get_session(sid)
+    if session.get("exp") is None or time.time() < session["exp"]:
+        return session["user_id"]
+
+    auth_token = data.get("auth_token", None)
+    if not auth_token:
+        raise ConnectionAbortedError("Authentication expired, a new auth_token is required.")
+
+    user, exp = await validate_client_credential(auth_token)
+    if user.id != session["user_id"]:
+        raise ConnectionAbortedError("auth_token belongs to a different user than this connection.")
+
+    await sio_server.save_session(sid, {"user_id": user.id, "exp": exp})
+    return user.id
+
+
+async def ensure_user_exists(user_id: int):
+    if known_user_ids.get(user_id):
+        return
+
+    async with AsyncSessionLocal() as db_session:
+        db_handler = AsyncDBHandler(db_session)
+        if not await db_handler.get_user_by_id(user_id):
+            raise ConnectionAbortedError("Invalid message recipient from client.")
+    known_user_ids.set(user_id, True)
+
 
 @sio_server.event
 async def connect(sid, environ, auth):
     # Extract token data on client connection event
     # Only allow socket connection if client provides valid authentication credentials
-    auth_token = auth.get("Authorization", None)
+    auth_token = (auth or {}).get("Authorization", None)
     if not auth_token:
         raise ConnectionRefusedError("No Authentication Information provided from client.")
     
     # Sanity check
-    client_identity = validate_client_credential(auth_token)
-    # use the in memory hashmap to track connected clients' socket ids
-    current_users[client_identity.id] = sid
+    client_identity, exp = await validate_client_credential(auth_token)
+    await sio_server.save_session(sid, {"user_id": client_identity.id, "exp": exp})
+    # the presence registry tracks connected clients' socket ids for every worker
+    await presence_registry.register(client_identity.id, sid)
+    # Emits only reach the client once connect has returned, so the backlog is sent from a background task
+    sio_server.start_background_task(send_dm_backlog, sid, client_identity.id)
     
-    logger.info(f"SERVER: socket id: {sid} is assigned client: {client_identity} on initial connection.")
-    logger.info(f"SERVER: all connected clients on server {current_users}")
+    logger.info(f"SERVER: socket id: {sid} is assigned client: {client_identity.id} on initial connection.")
+
+
+def serialize_dm(chat):
+    return {
+        "id": chat.id,
+        "content": chat.content,
+        "sender_id": chat.sender_id,
+        "receiver_id": chat.receiver_id,
+        "timestamp": chat.timestamp.isoformat(),
+    }
+
+
+async def acknowledge_dm(user_id: int, message_id: int, first_id: int = None, *client_args):
+    async with AsyncSessionLocal() as db_session:
+        db_handler = AsyncDBHandler(db_session)
+        await db_handler.advance_delivery_cursor(user_id, message_id, first_id)
+
+
+# Everything the user received while none of their devices acknowledged it, in batches of
+# DM_BACKLOG_BATCH_SIZE oldest first as one "dm_backlog" emit each. Acknowledging a batch advances the
+# delivery cursor past it and sends the next one, so a reconnect costs one indexed query per batch.
+async def send_dm_backlog(sid, user_id: int):
+    try:
+        async with AsyncSessionLocal() as db_session:
+            db_handler = AsyncDBHandler(db_session)
+            backlog = await db_handler.get_undelivered_messages(user_id, settings.DM_BACKLOG_BATCH_SIZE)
+    except Exception as e:
+        logger.warning(f"SERVER: could not load dm backlog for client {user_id}: {e}")
+        return
+
+    if not backlog:
+        return
+
+    async def on_ack(*client_args):
+        await acknowledge_dm(user_id, backlog[-1].id, backlog[0].id)
+        if len(backlog) == settings.DM_BACKLOG_BATCH_SIZE:
+            await send_dm_backlog(sid, user_id)
+
+    await sio_server.emit("dm_backlog", {"messages": [serialize_dm(chat) for chat in backlog], "has_more": len(backlog) == settings.DM_BACKLOG_BATCH_SIZE}, to=sid, callback=on_ack)
 
 
 @sio_server.event
 async def private_dm(sid, data):
     content = data.get("content", None)
     receiver_id = data.get("receiver_id", None)
-    auth_token = data.get("auth_token", None)
 
-    if not content or not receiver_id or not auth_token:
+    if not content or not receiver_id:
         raise ConnectionAbortedError("Missing required information from client.")
     
-    client_identity = validate_client_credential(auth_token)
+    sender_id = await get_client_identity(sid, data)
+    await ensure_user_exists(receiver_id)
 
     # persist the dm messages to database
     try:
-        with SessionLocal() as db_session:
-            db_handler = DBHandler(db_session)
-            receiver = db_handler.get_user_by_id(receiver_id)
-            if not receiver:
-                raise ConnectionAbortedError("Invalid message recipient from client.")
-            
-            db_handler.create_personal_chat_message(client_identity.id, receiver_id, content)
+        async with AsyncSessionLocal() as db_session:
+            db_handler = AsyncDBHandler(db_session)
+            chat = await db_handler.create_personal_chat_message(sender_id, receiver_id, content)
     except Exception as e:
         raise ConnectionAbortedError(str(e))
-    finally:
-        db_session.close()
     
 
     logger.info(f"SERVER: Private dm from client with socket id: {sid}. Content: {content} ")
-    receiver_sid = current_users.get(receiver_id, None)
-    if receiver_sid:
-        await sio_server.emit("private_dm", data, to=receiver_sid)
+    # Delivered to every device of the receiver. A device may be connected to another worker, the client
+    # manager routes the emit there. Only the message is forwarded, never the sender's auth_token.
+    # The delivery cursor moves once a device acknowledges and nothing older is outstanding, unacknowledged
+    # messages come back in the next backlog.
+    message = serialize_dm(chat)
+    for receiver_sid in await presence_registry.sids(receiver_id):
+        await sio_server.emit("private_dm", message, to=receiver_sid, callback=partial(acknowledge_dm, receiver_id, chat.id, chat.id))
+
+
+# Clients that cannot use socket.io acknowledgements can confirm messages explicitly with {"message_id": ...}.
+# Acknowledging a message also acknowledges every older one.
+@sio_server.event
+async def ack_dm(sid, data):
+    message_id = data.get("message_id", None)
+    if not message_id:
+        raise ConnectionAbortedError("Missing required information from client.")
+
+    user_id = await get_client_identity(sid, data)
+    await acknowledge_dm(user_id, message_id)
 
 
 @sio_server.event
 async def disconnect(sid):
-    current_user_id = None
-    for key, value in current_users.items():
-        if value == sid:
-            current_user_id = key
-    
-    # When client loses connections, remove user from in memory mapping
+    # When client loses connections, remove user from the presence registry
     # Not sure if this function will be called by socket io server by default when clients unexpectedly lose connection during session.
+    current_user_id = await presence_registry.unregister(sid)
     if current_user_id:
         logger.info("SERVER: remove logged out client from server.")
-        del current_users[current_user_id]
     
     logger.info(f"SERVER: client with socket id: {sid} disconnected.")
@@ -0,0 +1,89 @@
+import os
+import hashlib
+import logging
+from uuid import uuid4
+import anyio
+from sqlalchemy import select, update, or_, func
+from database import AsyncSessionLocal
+from db_config import settings
+from models import UserDetail
+from storage.media_store import media_store, content_key, remove_file_if_exists, CHUNK_SIZE
+from utils.image_variants import generate_variants
+
+logger = logging.getLogger(__name__)
+
+# Before the media store, uploads were written to /audio/{user_id}.mp3 and /pics/{user_id}.png and
+# user_details kept that path. Only those exact values are imported, and only from under LEGACY_MEDIA_ROOT,
+# so a value a client managed to write into the column can never pull another file off the server.
+LEGACY_MEDIA_FIELDS = {"audio_sample": ("audio", "mp3"), "profile_picture": ("pics", "png")}
+
+
+def legacy_value(field: str, user_id: int) -> str:
+    directory, extension = LEGACY_MEDIA_FIELDS[field]
+    return f"/{directory}/{user_id}.{extension}"
+
+
+# The file a legacy value refers to, resolved (symlinks included) under LEGACY_MEDIA_ROOT
+def legacy_file_path(field: str, user_id: int) -> str:
+    root = os.path.realpath(settings.LEGACY_MEDIA_ROOT)
+    path = os.path.realpath(os.path.join(root, legacy_value(field, user_id).lstrip("/")))
+    if os.path.commonpath([root, path]) != root:
+        raise FileNotFoundError(path)
+    return path
+
+
+# Copies a legacy file into the store's temp dir chunk by chunk while hashing it, like save_upload_file.
+# Returns (sha256 hex digest, temp path).
+def copy_legacy_file(path: str):
+    temp_path = os.path.join(media_store.temp_dir, f"{uuid4().hex}.part")
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as source, open(temp_path, "wb") as target:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                target.write(chunk)
+            target.flush()
+            os.fsync(target.fileno())
+    except BaseException:
+        remove_file_if_exists(temp_path)
+        raise
+    return digest.hexdigest(), temp_path
+
+
+# One time import of legacy media, run on startup. Each file is stored under its content key and the column is
+# rewritten only while it still holds the legacy path, so several workers running this at once, or a user
+# uploading meanwhile, can't lose anything. The legacy files are left in place, and once every row has been
+# imported the query finds nothing.
+async def import_legacy_media():
+    async with AsyncSessionLocal() as db:
+        query = select(UserDetail.user_id, UserDetail.audio_sample, UserDetail.profile_picture).where(or_(
+            UserDetail.audio_sample == func.concat("/audio/", UserDetail.user_id, ".mp3"),
+            UserDetail.profile_picture == func.concat("/pics/", UserDetail.user_id, ".png")))
+        rows = (await db.execute(query)).all()
+
+        imported = 0
+        for user_id, audio_sample, profile_picture in rows:
+            for field, value in (("audio_sample", audio_sample), ("profile_picture", profile_picture)):
+                legacy_path = legacy_value(field, user_id)
+                if value != legacy_path:
+                    continue
+                try:
+                    digest, temp_path = await anyio.to_thread.run_sync(copy_legacy_file, legacy_file_path(field, user_id))
+                    key = content_key(digest, LEGACY_MEDIA_FIELDS[field][1])
+                    await media_store.put_file(temp_path, key)
+                except OSError as e:
+                    logger.warning(f"Could not import legacy {field} {legacy_path} of user {user_id}: {e}")
+                    continue
+
+                column = getattr(UserDetail, field)
+                await db.execute(update(UserDetail).where(UserDetail.user_id == user_id, column == legacy_path).values({field: key}))
+                await db.commit()
+                if field == "profile_picture":
+                    await generate_variants(key)
+                imported += 1
+
+    if imported:
+        logger.warning(f"Imported {imported} legacy media files into the media store.")
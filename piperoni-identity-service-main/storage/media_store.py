@@ -0,0 +1,219 @@
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from functools import partial
+import anyio
+from db_config import settings
+
+CHUNK_SIZE = 64 * 1024 # bytes read per chunk, keeps memory flat per listener
+
+
+def content_key(digest: str, extension: str) -> str:
+    # sha256 hex digest sharded two levels deep, e.g. "3f/a2/3fa2...e1.mp3", so no directory gets huge
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{extension}"
+
+
+def derived_key(key: str, suffix: str, extension: str) -> str:
+    # Keys for files computed from a stored blob (e.g. resized images). Since the source key never
+    # changes content, a derived key is just as immutable.
+    stem, _ = os.path.splitext(key)
+    return f"{stem}_{suffix}.{extension}"
+
+
+def remove_file_if_exists(filepath: str):
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
+
+
+# Blob storage for user media. Blobs are immutable and addressed by key; uploads are keyed by their
+# content hash, so storing identical bytes twice is a no-op. Missing keys raise FileNotFoundError.
+class MediaStore(ABC):
+    # Where uploads are spooled before put_file
+    @property
+    @abstractmethod
+    def temp_dir(self) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def stat(self, key: str):
+        # Returns (size in bytes, last modified epoch seconds)
+        raise NotImplementedError
+
+    @abstractmethod
+    async def put_file(self, temp_path: str, key: str):
+        # Moves a fully written temp file into the store, consuming it. Does nothing if the key exists.
+        raise NotImplementedError
+
+    @abstractmethod
+    async def put_bytes(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def read(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def iter_range(self, key: str, start: int, length: int):
+        # Async generator of the bytes in [start, start + length), CHUNK_SIZE at a time
+        raise NotImplementedError
+        yield
+
+
+class LocalMediaStore(MediaStore):
+    def __init__(self, root: str) -> None:
+        super().__init__()
+        self.root = os.path.abspath(root)
+        # Temp files live under the root so put_file is a same-filesystem (atomic) rename
+        self._temp_dir = os.path.join(self.root, ".tmp")
+        self._temp_dir_ready = False
+
+    @property
+    def temp_dir(self) -> str:
+        # Created on first use rather than at import, so importing the app never needs a writable MEDIA_ROOT
+        if not self._temp_dir_ready:
+            os.makedirs(self._temp_dir, exist_ok=True)
+            self._temp_dir_ready = True
+        return self._temp_dir
+
+    def path_for(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep): # keys come from our db, but never let one escape the root
+            raise FileNotFoundError(key)
+        return path
+
+    async def exists(self, key: str) -> bool:
+        try:
+            path = self.path_for(key)
+        except FileNotFoundError:
+            return False
+        return await anyio.to_thread.run_sync(os.path.exists, path)
+
+    async def stat(self, key: str):
+        stat = await anyio.to_thread.run_sync(os.stat, self.path_for(key))
+        return stat.st_size, stat.st_mtime
+
+    def _move_into_place(self, temp_path: str, key: str):
+        path = self.path_for(key)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    async def put_file(self, temp_path: str, key: str):
+        await anyio.to_thread.run_sync(self._move_into_place, temp_path, key)
+
+    def _write_bytes(self, key: str, data: bytes):
+        path = self.path_for(key)
+        if os.path.exists(path):
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            self._move_into_place(temp_path, key)
+        except BaseException:
+            remove_file_if_exists(temp_path)
+            raise
+
+    async def put_bytes(self, key: str, data: bytes):
+        await anyio.to_thread.run_sync(self._write_bytes, key, data)
+
+    async def read(self, key: str) -> bytes:
+        async with await anyio.open_file(self.path_for(key), "rb") as f:
+            return await f.read()
+
+    async def iter_range(self, key: str, start: int, length: int):
+        # The file handle is closed when the client finishes or disconnects mid stream
+        async with await anyio.open_file(self.path_for(key), "rb") as f:
+            await f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+# Works with AWS S3 and any S3 compatible server (MinIO, localstack, ...) through MEDIA_S3_ENDPOINT_URL.
+# boto3 is only needed when this backend is selected: pip install boto3
+class S3MediaStore(MediaStore):
+    def __init__(self, bucket: str, endpoint_url: str = None, region: str = None, access_key: str = None, secret_key: str = None) -> None:
+        super().__init__()
+        import boto3
+
+        self.bucket = bucket
+        self.temp_dir = tempfile.gettempdir()
+        self._client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+
+    def _call(self, method: str, **kwargs):
+        from botocore.exceptions import ClientError
+
+        try:
+            return getattr(self._client, method)(Bucket=self.bucket, **kwargs)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(kwargs.get("Key"))
+            raise
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await anyio.to_thread.run_sync(partial(self._call, "head_object", Key=key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def stat(self, key: str):
+        head = await anyio.to_thread.run_sync(partial(self._call, "head_object", Key=key))
+        return head["ContentLength"], head["LastModified"].timestamp()
+
+    async def put_file(self, temp_path: str, key: str):
+        try:
+            if not await self.exists(key):
+                await anyio.to_thread.run_sync(self._client.upload_file, temp_path, self.bucket, key)
+        finally:
+            await anyio.to_thread.run_sync(remove_file_if_exists, temp_path)
+
+    async def put_bytes(self, key: str, data: bytes):
+        if not await self.exists(key):
+            await anyio.to_thread.run_sync(partial(self._call, "put_object", Key=key, Body=data))
+
+    async def read(self, key: str) -> bytes:
+        response = await anyio.to_thread.run_sync(partial(self._call, "get_object", Key=key))
+        return await anyio.to_thread.run_sync(response["Body"].read)
+
+    async def iter_range(self, key: str, start: int, length: int):
+        if length <= 0:
+            return
+        response = await anyio.to_thread.run_sync(partial(self._call, "get_object", Key=key, Range=f"bytes={start}-{start + length - 1}"))
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await anyio.to_thread.run_sync(body.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+
+def create_media_store() -> MediaStore:
+    if settings.MEDIA_STORE_BACKEND == "s3":
+        return S3MediaStore(
+            bucket=settings.MEDIA_S3_BUCKET,
+            endpoint_url=settings.MEDIA_S3_ENDPOINT_URL,
+            region=settings.MEDIA_S3_REGION,
+            access_key=settings.MEDIA_S3_ACCESS_KEY,
+            secret_key=settings.MEDIA_S3_SECRET_KEY,
+        )
+    return LocalMediaStore(settings.MEDIA_ROOT)
+
+
+media_store = create_media_store()
@@ -0,0 +1,186 @@
+import os
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from uuid import uuid4
+import anyio
+from fastapi import Request, Response, HTTPException, UploadFile, status
+from fastapi.responses import StreamingResponse, JSONResponse
+from storage.media_store import media_store, content_key, remove_file_if_exists, CHUNK_SIZE
+
+
+# Media URLs are per user and their content changes on every re-upload, so by default clients revalidate with the
+# ETag each time (a cheap 304). Only a URL pinned to one upload by its v= version may be cached for good.
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+PINNED_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def make_etag(key: str) -> str:
+    return f'"{key.rsplit("/", 1)[-1]}"'
+
+
+# Profile picture / audio keys are content hashes, passing one as v= gives every upload its own URL
+def media_version(key: str) -> str:
+    return key.rsplit("/", 1)[-1].split(".", 1)[0][:16]
+
+
+def is_pinned_to(request: Request, key: str) -> bool:
+    return request.query_params.get("v") == media_version(key)
+
+
+def parse_range_header(range_header: str, size: int):
+    # Returns (start, end) inclusive for a single "bytes=" range, or None when the header should be ignored.
+    # Multiple ranges are not supported and fall back to the full body, which the spec allows.
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    first, _, last = ranges.strip().partition("-")
+    try:
+        if not first: # suffix range, "bytes=-500" is the last 500 bytes
+            length = int(last)
+            if length <= 0:
+                raise ValueError
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+    except ValueError:
+        return None
+
+    # An empty file has no satisfiable range at all, suffix ranges included
+    if size == 0 or start >= size or end < start:
+        raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers={"Content-Range": f"bytes */{size}"})
+
+    return start, min(end, size - 1)
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+
+# Serves a small in-memory asset with a content hash ETag, answering matching If-None-Match with 304.
+# It stands in for a picture the user may upload at any moment (the default avatar), so it is always revalidated.
+def bytes_response(request: Request, content: bytes, media_type: str):
+    etag = f'"{hashlib.sha1(content).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if is_not_modified(request, etag, 0):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+# Serves a blob from the media store in chunks with conditional GET (ETag / Last-Modified -> 304) and single Range (206) support.
+# Keys are content addressed, so the key itself is a strong ETag. The URL usually isn't, so callers only pass
+# PINNED_CACHE_CONTROL when the request is pinned to this exact blob.
+async def stream_media_response(request: Request, key: str, media_type: str, cache_control: str = REVALIDATE_CACHE_CONTROL):
+    try:
+        size, mtime = await media_store.stat(key)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found.")
+
+    etag = make_etag(key)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(mtime, usegmt=True),
+        "Cache-Control": cache_control,
+    }
+
+    if is_not_modified(request, etag, mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = parse_range_header(range_header, size)
+
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(media_store.iter_range(key, start, end - start + 1), status_code=status.HTTP_206_PARTIAL_CONTENT, media_type=media_type, headers=headers)
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(media_store.iter_range(key, 0, size), media_type=media_type, headers=headers)
+
+
+# Caps the request body of the upload routes (path -> max bytes) while it is received. FastAPI hands a route its
+# UploadFile only after the whole multipart body has been parsed into a temp file, so a size check in the route
+# comes too late to stop a 5 GB upload. Bodies announcing a larger Content-Length are rejected before anything is
+# read, chunked ones are cut off as soon as they cross the limit.
+class UploadSizeLimitMiddleware:
+    def __init__(self, app, limits: dict) -> None:
+        super().__init__()
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        too_large = f"Request body must be at most {limit} bytes."
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": too_large}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, headers={"Connection": "close"})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # raised inside the form parsing, FastAPI turns it into the 413 response
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=too_large, headers={"Connection": "close"})
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# Copies an upload into the media store chunk by chunk, never holding more than one chunk in memory.
+# Data is spooled to a temp file while it is hashed; once it is complete and within max_bytes it is stored
+# under its sha256, so readers never see a truncated blob and identical uploads are stored once.
+# Returns the blob key.
+async def save_upload_file(upload: UploadFile, extension: str, max_bytes: int) -> str:
+    too_large = HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"File must be at most {max_bytes} bytes.")
+    if upload.size is not None and upload.size > max_bytes:
+        raise too_large
+
+    temp_filepath = os.path.join(media_store.temp_dir, f"{uuid4().hex}.part")
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        async with await anyio.open_file(temp_filepath, "wb") as f:
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise too_large
+                digest.update(chunk)
+                await f.write(chunk)
+            await f.flush()
+            await anyio.to_thread.run_sync(os.fsync, f.wrapped.fileno())
+
+        key = content_key(digest.hexdigest(), extension)
+        await media_store.put_file(temp_filepath, key)
+    except BaseException:
+        await anyio.to_thread.run_sync(remove_file_if_exists, temp_filepath)
+        raise
+
+    return key
@@ -0,0 +1,88 @@
+import math
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+DECODE_MAP = {char: index for index, char in enumerate(BASE32)}
+MAX_PRECISION = 12
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LON = 111.320 # at the equator, scaled by cos(latitude)
+
+
+def encode(latitude: float, longitude: float, precision: int = MAX_PRECISION) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        # bits alternate between longitude and latitude, longitude first
+        value, value_range = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (value_range[0] + value_range[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            value_range[0] = middle
+        else:
+            bits <<= 1
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def decode(geohash: str):
+    # Returns the cell center as (latitude, longitude)
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        index = DECODE_MAP[char]
+        for shift in range(4, -1, -1):
+            value_range = lon_range if even else lat_range
+            middle = (value_range[0] + value_range[1]) / 2
+            if (index >> shift) & 1:
+                value_range[0] = middle
+            else:
+                value_range[1] = middle
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def cell_size_degrees(precision: int):
+    # (latitude degrees, longitude degrees) covered by one cell
+    bits = precision * 5
+    return 180.0 / (1 << (bits // 2)), 360.0 / (1 << ((bits + 1) // 2))
+
+
+def precision_for_radius(radius_km: float, latitude: float) -> int:
+    # Longest prefix whose cells are at least radius_km tall and wide around this latitude, so the cell
+    # containing the center plus its 8 neighbours cover the whole circle
+    widest_latitude = min(abs(latitude) + radius_km / KM_PER_DEGREE_LAT, 89.9)
+    for precision in range(MAX_PRECISION, 0, -1):
+        lat_degrees, lon_degrees = cell_size_degrees(precision)
+        if lat_degrees * KM_PER_DEGREE_LAT >= radius_km and lon_degrees * KM_PER_DEGREE_LON * math.cos(math.radians(widest_latitude)) >= radius_km:
+            return precision
+    return 1
+
+
+def neighbours(geohash: str):
+    # The cell itself and the (up to) 8 cells around it, wrapping around the antimeridian
+    latitude, longitude = decode(geohash)
+    lat_degrees, lon_degrees = cell_size_degrees(len(geohash))
+    cells = []
+    for lat_step in (-1, 0, 1):
+        cell_latitude = latitude + lat_step * lat_degrees
+        if not -90.0 < cell_latitude < 90.0:
+            continue
+        for lon_step in (-1, 0, 1):
+            cell_longitude = (longitude + lon_step * lon_degrees + 180.0) % 360.0 - 180.0
+            cell = encode(cell_latitude, cell_longitude, len(geohash))
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def haversine_km(latitude1: float, longitude1: float, latitude2: float, longitude2: float) -> float:
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(longitude2 - longitude1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
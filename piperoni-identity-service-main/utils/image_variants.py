@@ -0,0 +1,78 @@
+import io
+import logging
+from pathlib import Path
+from PIL import Image, ImageOps
+from starlette.concurrency import run_in_threadpool
+from schemas import ProfilePictureSize
+from storage.media_store import media_store, derived_key
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels for each profile picture variant. Variants keep the aspect ratio and are never upscaled.
+VARIANT_MAX_EDGE = {
+    ProfilePictureSize.thumbnail: 96,
+    ProfilePictureSize.card: 320,
+    ProfilePictureSize.full: 1080,
+}
+VARIANT_FORMAT = "WEBP"
+VARIANT_MEDIA_TYPE = "image/webp"
+VARIANT_QUALITY = 80
+
+# Refuse to decode images that would need more than this many pixels (about 40 megapixels)
+Image.MAX_IMAGE_PIXELS = 40_000_000
+
+DEFAULT_AVATAR_PATH = Path(__file__).resolve().parent.parent / "assets" / "default_profile_pic.jpeg"
+
+
+def variant_key(original_key: str, size: ProfilePictureSize) -> str:
+    return derived_key(original_key, size.value, "webp")
+
+
+def load_image(source) -> Image.Image:
+    image = Image.open(source)
+    image = ImageOps.exif_transpose(image) # phone cameras store rotation in EXIF
+    return image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+
+
+def encode_variant(image: Image.Image, size: ProfilePictureSize) -> bytes:
+    variant = image.copy()
+    max_edge = VARIANT_MAX_EDGE[size]
+    variant.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    variant.save(buffer, format=VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def encode_variants(content: bytes):
+    image = load_image(io.BytesIO(content))
+    return {size: encode_variant(image, size) for size in VARIANT_MAX_EDGE}
+
+
+# Runs as a background task after an upload: the original is decoded once (on the threadpool) and every
+# variant is encoded from that decoded image. Variant keys derive from the content addressed original, so
+# variants that already exist (same picture uploaded before, by anyone) are not built again.
+async def generate_variants(original_key: str):
+    missing = [size for size in VARIANT_MAX_EDGE if not await media_store.exists(variant_key(original_key, size))]
+    if not missing:
+        return
+
+    try:
+        content = await media_store.read(original_key)
+        variants = await run_in_threadpool(encode_variants, content)
+    except Exception as e:
+        logger.warning(f"Could not decode uploaded image {original_key}: {e}")
+        return
+
+    for size in missing:
+        await media_store.put_bytes(variant_key(original_key, size), variants[size])
+
+
+# The default avatar ships with the service and is encoded into every variant once, on first use
+default_avatar_variants = {}
+
+def get_default_avatar(size: ProfilePictureSize) -> bytes:
+    if size not in default_avatar_variants:
+        image = load_image(DEFAULT_AVATAR_PATH)
+        default_avatar_variants[size] = encode_variant(image, size)
+    return default_avatar_variants[size]
@@ -0,0 +1,45 @@
+from collections import OrderedDict
+from time import time
+
+
+# Small in-process LRU cache where every entry also carries its own expiry time (epoch seconds).
+# Not thread safe on purpose: it is only used from the event loop thread.
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (expires_at, value)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        expires_at, value = entry
+        if expires_at <= time():
+            del self._entries[key]
+            return default
+
+        self._entries.move_to_end(key) # mark as most recently used
+        return value
+
+    def set(self, key, value, expires_at: float = None):
+        # expires_at can only shorten the default ttl, never extend it
+        default_expiry = time() + self.ttl
+        if expires_at is None or expires_at > default_expiry:
+            expires_at = default_expiry
+
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False) # evict least recently used
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)